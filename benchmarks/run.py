@@ -0,0 +1,144 @@
+"""
+Offline benchmarks of trackers, consume_replay() and plotting, on synthetic replays (see synthetic.py).
+
+    python -m benchmarks.run                      # report
+    python -m benchmarks.run --save-baseline      # report and store the results as the baseline
+    python -m benchmarks.run --check              # report and fail if anything got slower than the baseline
+
+Each benchmark is timed as the best of several repeats, then run once more under tracemalloc for its peak memory.
+"""
+
+import matplotlib
+matplotlib.use('Agg')
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from matplotlib.figure import Figure
+
+from sc2_skill_tracker.event_dispatch import EventDispatcher
+from sc2_skill_tracker.plotter import consume_replay
+from sc2_skill_tracker.replay_context import ReplayContext
+from sc2_skill_tracker.timeline import Timeline
+from sc2_skill_tracker.trackers.DroneTracker import DroneTracker
+from sc2_skill_tracker.trackers.InjectTracker import InjectTracker
+from sc2_skill_tracker.trackers.LarvaeVsResourcesTracker import LarvaeVsResourcesTracker
+from sc2_skill_tracker.trackers.UpgradeTracker import UpgradeTracker
+
+from .synthetic import generate_session
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+PLAYER = 'orastem'
+TRACKERS = [LarvaeVsResourcesTracker, DroneTracker, InjectTracker, UpgradeTracker]
+PLOT_TRACKERS = [LarvaeVsResourcesTracker, DroneTracker, InjectTracker]
+
+
+def consumed_tracker(session, tracker_class):
+    """ Returns a tracker of tracker_class that consumed all events of the session """
+    tracker = tracker_class(PLAYER)
+    tracker.resolve(ReplayContext(session.players))
+    dispatcher = EventDispatcher([tracker])
+    for event in session.events():
+        dispatcher.dispatch(event)
+    return tracker
+
+
+def benchmarks(session):
+    """ Returns {name: (function to time, number of events it processes or None)} """
+    event_count = sum(1 for _ in session.events())
+    cutoff = session.length
+    timeline = Timeline(cutoff)
+
+    result = {}
+    for tracker_class in TRACKERS:
+        result[f'consume_event/{tracker_class.__name__}'] = (lambda tracker_class=tracker_class: consumed_tracker(session, tracker_class), event_count)
+
+    result['consume_replay'] = (lambda: consume_replay(session, [tracker(name) for name in [PLAYER, 'opponent'] for tracker in TRACKERS]), event_count)
+
+    inject_tracker = consumed_tracker(session, InjectTracker)
+    result['inject_history'] = (lambda: [inject_tracker.inject_history(i, cutoff) for i in range(len(inject_tracker.hatchery_history))], None)
+    result['inject_intervals'] = (lambda: inject_tracker.inject_intervals(cutoff), None)
+
+    for tracker_class in PLOT_TRACKERS:
+        tracker = consumed_tracker(session, tracker_class)
+        def plot(tracker=tracker):
+            figure = Figure(figsize=(18, 12))
+            tracker.plot(figure.subplots(), timeline)
+            figure.canvas.draw() # so that the time includes rendering, not just building the artists
+        result[f'plot/{tracker_class.__name__}'] = (plot, None)
+        result[f'resample/{tracker_class.__name__}'] = (lambda tracker=tracker: tracker.resample(timeline), None)
+
+    return result
+
+
+def measure(function, repeats):
+    seconds = min(timed(function) for _ in range(repeats))
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return seconds, peak
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run(minutes, repeats, baseline_path, save_baseline, check, tolerance):
+    # checked before running anything, there's nothing to compare with
+    if check and not save_baseline and not os.path.isfile(baseline_path):
+        print(f"no baseline at {baseline_path}, run without --check (with --save-baseline) first")
+        return False
+
+    session = generate_session(minutes)
+    results = {}
+    print(f"{'benchmark':40} {'seconds':>10} {'events/s':>12} {'peak MB':>8}")
+    for name, (function, event_count) in benchmarks(session).items():
+        seconds, peak = measure(function, repeats)
+        results[name] = {'seconds': seconds, 'peak_bytes': peak,
+                         'events_per_second': event_count / seconds if event_count else None}
+        events_per_second = f"{event_count / seconds:12.0f}" if event_count else f"{'':12}"
+        print(f"{name:40} {seconds:10.4f} {events_per_second} {peak / 1024 / 1024:8.2f}")
+
+    if save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump({'minutes': minutes, 'results': results}, f, indent=2)
+        print(f"baseline saved to {baseline_path}")
+
+    if check:
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['minutes'] != minutes:
+            print(f"baseline was measured on {baseline['minutes']} minute games, not {minutes}")
+            return False
+
+        regressions = [name for name in results if name in baseline['results']
+                       and results[name]['seconds'] > baseline['results'][name]['seconds'] * (1 + tolerance)]
+        for name in regressions:
+            print(f"REGRESSION {name}: {results[name]['seconds']:.4f}s vs {baseline['results'][name]['seconds']:.4f}s baseline")
+        return not regressions
+
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-m', '--minutes', type=float, default=15, dest='minutes', action='store', help='length of the synthetic game in game minutes')
+    parser.add_argument('-r', '--repeats', type=int, default=5, dest='repeats', action='store', help='time each benchmark as the best of this many runs')
+    parser.add_argument('-b', '--baseline', type=str, default=DEFAULT_BASELINE, dest='baseline', action='store', help='baseline file')
+    parser.add_argument('--save-baseline', dest='save_baseline', action='store_true', help='store results as the baseline')
+    parser.add_argument('--check', dest='check', action='store_true', help='exit with an error if any benchmark is slower than the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, dest='tolerance', action='store', help='allowed slowdown vs the baseline, e.g. 0.2 for 20%%')
+
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.minutes, args.repeats, args.baseline, args.save_baseline, args.check, args.tolerance) else 1)
@@ -0,0 +1,111 @@
+"""
+Startup time budget of commands that shouldn't need matplotlib, sc2reader or NumPy - they take longer to import than
+these commands need to run.
+
+    python -m benchmarks.startup            # report
+    python -m benchmarks.startup --check    # report and fail if over budget, or if a heavy module got imported
+
+Doesn't import anything heavy itself, every command runs in a fresh interpreter. cleanup_replays_dir also runs for
+real, on a temporary replays directory whose index is up to date - the common case after a game, which shouldn't
+need to open any replays either.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+HEAVY_MODULES = ['matplotlib', 'sc2reader', 'numpy']
+
+# name: (module to run, its command line arguments) - {replays_dir} is filled in, see up_to_date_replays()
+COMMANDS = {'plotter --help': ('sc2_skill_tracker', ['--help']),
+            'cleanup_replays_dir --help': ('sc2_skill_tracker.cleanup_replays_dir', ['--help']),
+            'cleanup_replays_dir (indexed)': ('sc2_skill_tracker.cleanup_replays_dir', ['-d', '{replays_dir}'])}
+
+DEFAULT_BUDGET = 0.3 # seconds
+
+REPLAYS = 50
+
+
+def up_to_date_replays(directory):
+    """ Fills directory with made up replays (1v1 ladder games, which cleanup keeps) in a replays/ directory, indexed
+        as they are in a cache/ directory. Returns (replays directory, environment to run commands in).
+    """
+    replays_dir = os.path.join(directory, 'replays')
+    cache_dir = os.path.join(directory, 'cache')
+    os.makedirs(replays_dir)
+
+    from sc2_skill_tracker.replay_index import ReplayIndex # doesn't import anything heavy, checked by the commands
+    index = ReplayIndex(os.path.join(cache_dir, 'replay_index.sqlite3'))
+    for i in range(REPLAYS):
+        path = os.path.join(replays_dir, f'game{i}.SC2Replay')
+        with open(path, 'wb') as f:
+            f.write(b'not really a replay')
+        players = [{'pid': 1, 'name': 'orastem', 'race': 'Zerg', 'is_human': True},
+                   {'pid': 2, 'name': 'someone', 'race': 'Terran', 'is_human': True}]
+        index.add(path, os.stat(path), {'error': None, 'hash': str(i), 'map_name': 'Alcyone LE', 'duration': 600,
+                                        'players': players, 'is_1v1_vs_human': True})
+    index.connection.close()
+
+    return replays_dir, dict(os.environ, SC2_SKILL_TRACKER_CACHE_PATH=cache_dir) # see replay_helpers.CACHE_PATH_VAR
+
+
+def best_time(arguments, env, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + arguments, env=env, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def heavy_imports(module, arguments, env):
+    """ Returns HEAVY_MODULES imported by running the module with the arguments """
+    script = (f"import atexit, runpy, sys\n"
+              f"atexit.register(lambda: print(' '.join(name for name in {HEAVY_MODULES!r} if name in sys.modules), file=sys.stderr))\n"
+              f"sys.argv = [{module!r}] + {arguments!r}\n"
+              f"runpy.run_module({module!r}, run_name='__main__', alter_sys=True)")
+    result = subprocess.run([sys.executable, '-c', script], env=env, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                            text=True)
+    return result.stderr.split()
+
+
+def run(repeats, budget, check):
+    with tempfile.TemporaryDirectory() as directory:
+        replays_dir, env = up_to_date_replays(directory)
+        ok = run_commands(replays_dir, env, repeats, budget, check)
+        # otherwise the later runs timed a different (emptier) directory
+        assert len(os.listdir(replays_dir)) == REPLAYS, "cleanup_replays_dir deleted indexed 1v1 ladder games"
+        return ok
+
+
+def run_commands(replays_dir, env, repeats, budget, check):
+    ok = True
+    print(f"{'command':40} {'seconds':>10}  heavy imports")
+    for name, (module, arguments) in COMMANDS.items():
+        arguments = [argument.format(replays_dir=replays_dir) for argument in arguments]
+        seconds = best_time(['-m', module] + arguments, env, repeats)
+        heavy = heavy_imports(module, arguments, env)
+        print(f"{name:40} {seconds:10.3f}  {', '.join(heavy) or '-'}")
+
+        if seconds > budget:
+            print(f"OVER BUDGET {name}: {seconds:.3f}s vs {budget:.3f}s")
+            ok = False
+        if heavy:
+            print(f"HEAVY IMPORTS {name}: {', '.join(heavy)}")
+            ok = False
+
+    return ok or not check
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeats', type=int, default=5, dest='repeats', action='store', help='time each command as the best of this many runs')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, dest='budget', action='store', help='allowed startup time in seconds')
+    parser.add_argument('--check', dest='check', action='store_true', help='exit with an error if a command is over budget or imports heavy modules')
+
+    args = parser.parse_args()
+
+    sys.exit(0 if run(args.repeats, args.budget, args.check) else 1)
@@ -0,0 +1,160 @@
+"""
+Synthetic sc2reader-like replays for benchmarking trackers without replay files. Events are instances of the real
+sc2reader event classes (so isinstance checks and dispatch behave as with real replays), with just the attributes
+the trackers read filled in.
+"""
+
+import random
+
+from sc2reader.events import (PlayerStatsEvent, UnitBornEvent, UnitDiedEvent, UnitDoneEvent, UnitTypeChangeEvent,
+                              UpgradeCompleteEvent, TargetUnitCommandEvent, PlayerLeaveEvent, CameraEvent)
+
+from sc2_skill_tracker.replay_helpers import ReplaySession
+
+FRAMES_PER_SECOND = 16 # game seconds
+STATS_INTERVAL = 10 * FRAMES_PER_SECOND
+INJECT_INTERVAL = 29 * FRAMES_PER_SECOND
+LARVA_INTERVAL = 11 * FRAMES_PER_SECOND
+CAMERA_EVENTS_PER_SECOND = 4 # per player - stands in for all the game events trackers ignore
+UPGRADES = ['ZergMissileWeaponsLevel1', 'ZergGroundArmorsLevel1', 'ZergMissileWeaponsLevel2', 'ZergGroundArmorsLevel2']
+
+
+class SyntheticPlayer(object):
+    def __init__(self, pid, name, play_race='Zerg'):
+        self.pid = pid
+        self.name = name
+        self.play_race = play_race
+        self.is_human = True
+
+
+class SyntheticUnit(object):
+    def __init__(self, unit_id, name, owner):
+        self.id = unit_id
+        self.name = name
+        self.owner = owner
+
+
+class SyntheticReplay(object):
+    def __init__(self, players, tracker_events, game_events, frames):
+        self.players = players
+        self.tracker_events = tracker_events
+        self.game_events = game_events
+        self.frames = frames
+
+
+class SyntheticSession(ReplaySession):
+    """ ReplaySession whose replay is already 'loaded' - consume_replay() takes it like any other session """
+    def __init__(self, replay):
+        super().__init__('<synthetic>')
+        self._replay = replay
+        self._load_level = ReplaySession.FULL_LOAD_LEVEL
+
+
+def make_event(event_class, frame, **attributes):
+    # skipping sc2reader's constructors - they parse raw replay data
+    event = event_class.__new__(event_class)
+    event.frame = frame
+    event.second = frame >> 4
+    event.__dict__.update(attributes)
+    return event
+
+
+class ReplayGenerator(object):
+    def __init__(self, minutes, seed):
+        self.frames = int(minutes * 60 * FRAMES_PER_SECOND)
+        self.random = random.Random(seed)
+        self.next_unit_id = 1
+        self.tracker_events = []
+        self.game_events = []
+
+
+    def unit(self, name, owner):
+        unit = SyntheticUnit(self.next_unit_id, name, owner)
+        self.next_unit_id += 1
+        return unit
+
+
+    def born(self, frame, unit):
+        self.tracker_events.append(make_event(UnitBornEvent, frame, unit=unit, unit_id=unit.id))
+
+
+    def died(self, frame, unit):
+        if frame < self.frames:
+            self.tracker_events.append(make_event(UnitDiedEvent, frame, unit=unit, unit_id=unit.id))
+
+
+    def player_events(self, player):
+        # hatcheries: the main one is born, expansions are done every couple of minutes, one of them dies
+        hatcheries = [(0, self.unit('Hive', player))]
+        self.born(0, hatcheries[0][1])
+        for frame in range(150 * FRAMES_PER_SECOND, self.frames, 160 * FRAMES_PER_SECOND):
+            hatchery = self.unit('Hatchery', player)
+            self.tracker_events.append(make_event(UnitDoneEvent, frame, unit=hatchery, unit_id=hatchery.id))
+            hatcheries.append((frame, hatchery))
+        if len(hatcheries) > 2:
+            self.died(self.frames * 4 // 5, hatcheries[-1][1])
+
+        # drones: 12 at the start, then one every few seconds, some killed
+        for frame in [0] * 12 + list(range(12 * FRAMES_PER_SECOND, self.frames, 5 * FRAMES_PER_SECOND)):
+            drone = self.unit('Drone', player)
+            self.born(frame, drone)
+            if self.random.random() < 0.1:
+                self.died(frame + self.random.randrange(60, 600) * FRAMES_PER_SECOND, drone)
+
+        # larvae: spawn at every hatchery, become eggs (type change there and back), then die when hatching
+        for created, hatchery in hatcheries:
+            for frame in range(created, self.frames, LARVA_INTERVAL):
+                larva = self.unit('Larva', player)
+                self.born(frame, larva)
+                morph = frame + self.random.randrange(1, 30) * FRAMES_PER_SECOND
+                hatch = morph + 17 * FRAMES_PER_SECOND
+                if hatch < self.frames:
+                    self.tracker_events.append(make_event(UnitTypeChangeEvent, morph, unit=larva, unit_type_name='Egg'))
+                    self.tracker_events.append(make_event(UnitTypeChangeEvent, hatch, unit=larva, unit_type_name='Larva'))
+                    self.died(hatch, larva)
+
+        # queens and injects (with a bit of jitter, so that some injects get queued)
+        for created, hatchery in hatcheries:
+            queen_frame = created + 50 * FRAMES_PER_SECOND
+            if queen_frame >= self.frames:
+                continue
+            self.born(queen_frame, self.unit('Queen', player))
+            for frame in range(queen_frame, self.frames, INJECT_INTERVAL):
+                frame += self.random.randrange(0, 15) * FRAMES_PER_SECOND
+                if frame < self.frames:
+                    self.game_events.append(make_event(TargetUnitCommandEvent, frame, player=player, ability=object(),
+                                                       ability_name='SpawnLarva', target_unit_id=hatchery.id))
+
+        # stats
+        drones = 12
+        for frame in range(0, self.frames, STATS_INTERVAL):
+            drones = min(80, drones + 2)
+            self.tracker_events.append(make_event(PlayerStatsEvent, frame, player=player,
+                                                  food_used=drones + frame // 600, food_made=14 + frame // 400,
+                                                  minerals_current=self.random.randrange(0, 600),
+                                                  vespene_current=self.random.randrange(0, 300),
+                                                  minerals_lost=0, minerals_used_current=frame // 10))
+
+        for i, upgrade in enumerate(UPGRADES):
+            frame = (240 + 150 * i) * FRAMES_PER_SECOND
+            if frame < self.frames:
+                self.tracker_events.append(make_event(UpgradeCompleteEvent, frame, player=player, upgrade_type_name=upgrade))
+
+        for frame in range(0, self.frames, FRAMES_PER_SECOND // CAMERA_EVENTS_PER_SECOND):
+            self.game_events.append(make_event(CameraEvent, frame, player=player))
+
+
+def generate_session(minutes=15, seed=0):
+    """ Returns a SyntheticSession of a ZvZ game of the given length (in game minutes) """
+    generator = ReplayGenerator(minutes, seed)
+    players = [SyntheticPlayer(1, 'orastem'), SyntheticPlayer(2, 'opponent')]
+    for player in players:
+        generator.player_events(player)
+    generator.game_events.append(make_event(PlayerLeaveEvent, generator.frames, player=players[1]))
+
+    # stable sorts - events of the same frame stay in the order they were generated
+    replay = SyntheticReplay(players,
+                             sorted(generator.tracker_events, key=lambda event: event.frame),
+                             sorted(generator.game_events, key=lambda event: event.frame),
+                             generator.frames)
+    return SyntheticSession(replay)
@@ -7,52 +7,99 @@ Deletes non-ladder games from the replays directory, specifically:
 """
 
 import os
+import sys
 import argparse
-from pathlib import Path
 
-from .replay_helpers import replays_dir, discover_players
+from . import profiling
+from .parallel import ordered_map
+from .replay_helpers import REPLAY_PATH_VAR, replays_dir, coop_maps
+from .replay_index import ReplayIndex, read_metadata
+from .SC2SkillTrackerException import SC2SkillTrackerException
 
 
-files = iter(sorted(Path(replays_dir).iterdir(), key = lambda f: f.stat().st_ctime, reverse=True))
-all_replay_count = len(os.listdir(replays_dir))
+def newest_replays(directory, number_of_replays=None):
+    """ Returns (path, os.stat()) of the most recent files in the directory, newest first
+        :param number_of_replays: all of them if None
+    """
+    with os.scandir(directory) as entries:
+        replays = [(os.path.abspath(entry.path), entry.stat()) for entry in entries if entry.is_file()]
 
-coop_maps = ["Void Thrashing", "Void Launch", "Oblivion Express", "Rifts to Korhal", "Temple of the Past",
-             "Lock & Load", "Chain of Ascension", "The Vermillion Problem", "Mist Opportunities", "Miner Evacuation",
-             "Dead of Night", "Scythe of Amon", "Part and Parcel", "Malwarfare", "Cradle of Death"]
+    replays.sort(key=lambda replay: replay[1].st_ctime, reverse=True)
+    return replays[:number_of_replays]
 
-def run(number_of_replays):
-    for (i, f) in enumerate(files):
-        if i >= number_of_replays:
-            break
 
-        abspath = str(f.resolve())
+def classify_replay(path, players):
+    """ Returns the reason to delete the replay, None if it should be kept
+        :param players: (pid, name, race, is_human) rows from the replay index
+    """
+    if len(players) != 2:
+        return "non 1v1"
+    if any(name.startswith("A.I. 1") for _, name, _, _ in players):
+        return "vs AI"
+
+    return None
 
-        # don't know where these come from
-        if abspath.endswith('.writeCacheBackup'):
-            os.remove(abspath)
-            continue
 
-        print(f"processing: {(i+1)/number_of_replays*100:.1f}%\r", end = "")
+def delete(path, index):
+    os.remove(path)
+    index.remove(path)
 
-        if any([coop_name in abspath for coop_name in coop_maps]):
-            os.remove(abspath)
-            print("deleted coop:", f)
+
+def run(directory, number_of_replays=None, jobs=1):
+    if directory is None:
+        # os.scandir(None) would scan (and delete from) the working directory
+        raise SC2SkillTrackerException(f"No replays directory, pass --replays-dir or set {REPLAY_PATH_VAR}")
+
+    index = ReplayIndex()
+    to_classify = []
+    for path, stat in newest_replays(directory, number_of_replays):
+        # don't know where these come from
+        if path.endswith('.writeCacheBackup'):
+            delete(path, index)
             continue
 
-        players = discover_players(abspath)
-        if len(players) != 2:
-            print("deleted non 1v1:", f)
-            os.remove(abspath)
+        # condemned by the path alone, no need to read them
+        if any([coop_name in path for coop_name in coop_maps]):
+            print("deleted coop:", path)
+            delete(path, index)
             continue
-        if any(player.name.startswith("A.I. 1") for player in players):
-            print("deleted vs AI:", f)
-            os.remove(abspath)
+
+        to_classify.append((path, stat))
+
+    # only replays that aren't indexed as they are now are opened (in parallel with jobs > 1)
+    unindexed = [(path, stat) for path, stat in to_classify if not index.is_current(path, stat)]
+    with profiling.phase('index_update'):
+        for (path, stat), metadata in zip(unindexed, ordered_map(read_metadata, [path for path, _ in unindexed], jobs)):
+            index.add(path, stat, metadata)
+
+    for (i, (path, _)) in enumerate(to_classify):
+        print(f"processing: {(i+1)/len(to_classify)*100:.1f}%\r", end = "")
+
+        error = index.error(path)
+        if error is not None:
+            print("can't read, skipping:", path, error)
             continue
 
+        with profiling.phase('classify', path):
+            reason = classify_replay(path, index.players(path))
+        if reason is not None:
+            print(f"deleted {reason}:", path)
+            delete(path, index)
+
 if __name__ == '__main__':
-    parser = argparse.ArgumentParser()
-    parser.add_argument('-n', '--number-of-replays', type=int, default=all_replay_count, dest='number_of_replays', action='store', help='number of most recent replays to process')
+    parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
+    parser.add_argument('-d', '--replays-dir', type=str, default=replays_dir, dest='replays_dir', action='store', help='replay search path')
+    parser.add_argument('-n', '--number-of-replays', type=int, dest='number_of_replays', action='store', help='number of most recent replays to process (default: all)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, dest='jobs', action='store', help='number of worker processes parsing replays in parallel')
+
+    profiling.add_arguments(parser)
 
     args = parser.parse_args()
+    profiling.enable_from_args(args)
 
-    run(args.number_of_replays)
+    try:
+        run(args.replays_dir, args.number_of_replays, args.jobs)
+    except SC2SkillTrackerException as e:
+        print("Error: " + str(e))
+        sys.exit(1)
+    profiling.write_from_args(args)
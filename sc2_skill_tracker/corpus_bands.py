@@ -0,0 +1,218 @@
+"""
+Percentile bands of a player's own games, per matchup: for every second of the game, the distribution of drone
+count, banked larvae and the fraction of hatcheries injected over all of the player's replays of that matchup - so
+that a game can be plotted against what is normal for the player (see plotter --bands), not just against a
+hand-tuned target.
+
+Every metric is kept as a histogram per second (a fixed-bin quantile sketch - adding a replay is a vectorised
+increment, sketches of any number of replays add up, and percentiles are read off with an error of at most a bin).
+Bands are stored per player and matchup in <cache dir>/bands and are built incrementally: only replays that aren't in
+them yet are parsed.
+
+    python -m sc2_skill_tracker.corpus_bands -p orastem        # bring the bands of all matchups up to date
+
+Replays deleted from the replays directory stay counted in the bands, delete the bands to start over.
+"""
+
+import argparse
+import os
+
+from functools import partial
+
+import numpy as np
+
+from .event_cache import EventCache
+from .file_helpers import atomic_write
+from .parallel import ordered_map
+from .replay_helpers import replays_dir, cache_dir, ReplaySession
+from .replay_index import ReplayIndex
+from .result_cache import ResultCache
+
+MATCHUPS = ['ZvZ', 'ZvT', 'ZvP']
+
+# name: (histogram range, bins) - integer counts get a bin per value, centered on it
+METRICS = {'drones': ((-0.5, 99.5), 100),
+           'larvae': ((-0.5, 39.5), 40),
+           'injected': ((0, 1), 20)} # fraction of hatcheries that could be injected that are
+
+MAX_TIME = 2520 # game seconds (30 real minutes), games are only sampled until then
+STEP = 1 # game seconds
+
+# percentiles are only shown for seconds with at least this many replays
+MIN_SAMPLES = 5
+
+BANDS_DIR = os.path.join(cache_dir, 'bands')
+
+
+def bands_path(player, matchup, directory=BANDS_DIR):
+    return os.path.join(directory, f'{ResultCache.key(player)}-{matchup.upper()}.npz')
+
+
+def metric_values(drone_tracker, larvae_tracker, inject_tracker, timeline):
+    """ Returns {metric: values on the Timeline's grid} of one player's consumed trackers, NaN where undefined """
+    from .trackers.InjectTracker import injected_fraction
+
+    return {'drones': drone_tracker.resample(timeline)['drones'],
+            'larvae': larvae_tracker.resample(timeline)['larvae'],
+            'injected': injected_fraction(inject_tracker.resample(timeline))}
+
+
+def to_bins(metric, values):
+    """ Returns histogram bin indices of values, -1 for NaN """
+    (low, high), bins = METRICS[metric]
+    values = np.asarray(values, dtype=float)
+    scaled = np.nan_to_num((values - low) / (high - low) * bins, nan=-1)
+    return np.where(np.isnan(values), -1, np.clip(scaled.astype(np.int32), 0, bins - 1)).astype(np.int16)
+
+
+def replay_samples(replay, player, event_cache=None):
+    """ Returns (replay hash, {metric: bin index per second}, None), or (replay hash, None, error message) if the
+        replay can't be read
+        :param replay: (replay file, replay hash)
+    """
+    from .plotter import consume_replay
+    from .timeline import Timeline
+    from .trackers.DroneTracker import DroneTracker
+    from .trackers.InjectTracker import InjectTracker
+    from .trackers.LarvaeVsResourcesTracker import LarvaeVsResourcesTracker
+
+    replay_file, replay_hash = replay
+    trackers = [DroneTracker(player), LarvaeVsResourcesTracker(player), InjectTracker(player)]
+    try:
+        true_cutoff = consume_replay(ReplaySession(replay_file, event_cache), trackers, MAX_TIME)
+        values = metric_values(*trackers, Timeline(true_cutoff, STEP))
+    except Exception as e:
+        return replay_hash, None, f'{type(e).__name__}: {e}'
+
+    return replay_hash, {metric: to_bins(metric, values[metric]) for metric in METRICS}, None
+
+
+class CorpusBands(object):
+    """ Per-second histograms of METRICS over a corpus of replays """
+    # bump whenever the stored format, METRICS or what they measure changes
+    VERSION = 1
+
+    def __init__(self):
+        self.replays = set() # hashes of replays in the histograms
+        self.counts = {metric: np.zeros((int(MAX_TIME / STEP), bins), dtype=np.int32) for metric, (_, bins) in METRICS.items()}
+
+
+    def add(self, replay_hash, samples):
+        """ :param samples: {metric: bin index per second}, see replay_samples() """
+        self.replays.add(replay_hash)
+        for metric, bins in samples.items():
+            seconds = np.flatnonzero(bins >= 0)
+            np.add.at(self.counts[metric], (seconds, bins[seconds]), 1)
+
+
+    def sample_count(self, metric):
+        """ Number of replays with a value at every second """
+        return self.counts[metric].sum(axis=1)
+
+
+    def percentiles(self, metric, percentiles, length=None):
+        """ Returns an array (percentiles, seconds), NaN at seconds with less than MIN_SAMPLES replays. Values are
+            interpolated linearly within bins.
+            :param length: number of seconds, padded with NaN beyond MAX_TIME
+        """
+        (low, high), bins = METRICS[metric]
+        counts = self.counts[metric][:length]
+        cumulative = np.cumsum(counts, axis=1)
+        total = cumulative[:, -1]
+
+        result = np.full((len(percentiles), len(counts) if length is None else length), np.nan)
+        for i, percentile in enumerate(percentiles):
+            target = total * percentile / 100
+            # first bin that reaches the target
+            bin_index = np.minimum(np.count_nonzero(cumulative < target[:, None], axis=1), bins - 1)
+            seconds = np.arange(len(counts))
+            below = np.where(bin_index > 0, cumulative[seconds, bin_index - 1], 0)
+            within = counts[seconds, bin_index]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                fraction = np.where(within > 0, (target - below) / within, 0.5)
+            values = low + (bin_index + fraction) * (high - low) / bins
+            result[i, :len(counts)] = np.where(total >= MIN_SAMPLES, values, np.nan)
+
+        return result
+
+
+    def plot(self, axes, metric, timeline, color, label):
+        """ Draws the 10-90th and 25-75th percentile bands and the median of metric on the Timeline's grid. Returns
+            a legend handle.
+        """
+        assert(timeline.step == STEP)
+        low, quartile_low, median, quartile_high, high = self.percentiles(metric, [10, 25, 50, 75, 90], len(timeline))
+
+        times = timeline.times
+        axes.fill_between(times, low, high, step='post', color=color, alpha=0.1, lw=0)
+        axes.fill_between(times, quartile_low, quartile_high, step='post', color=color, alpha=0.2, lw=0)
+        median_plot, = axes.step(times, median, where='post', color=color, ls='--', lw=1,
+                                 label=f'{label} (median, 25-75th, 10-90th percentile of {self.sample_count(metric).max()} games)')
+        return median_plot
+
+
+    def save(self, path):
+        with atomic_write(path, 'wb') as f:
+            np.savez_compressed(f, version=CorpusBands.VERSION, replays=np.array(sorted(self.replays), dtype=str),
+                                **self.counts)
+
+
+    @staticmethod
+    def load(path):
+        """ Returns the stored bands, or empty ones if there are none (or they're of an older VERSION) """
+        bands = CorpusBands()
+        try:
+            with np.load(path) as data:
+                if int(data['version']) != CorpusBands.VERSION:
+                    return bands
+                replays, counts = set(data['replays'].tolist()), {metric: data[metric] for metric in METRICS}
+        except (FileNotFoundError, ValueError, KeyError):
+            return bands
+
+        bands.replays, bands.counts = replays, counts
+        return bands
+
+
+def update(bands, replays, player, jobs=1, event_cache=None):
+    """ Adds the replays that aren't in the bands yet. Returns the number of replays added - replays that can't be
+        read are skipped, and tried again the next time.
+        :param replays: (replay file, replay hash) pairs, e.g. from ReplayIndex.hashes()
+    """
+    new = [replay for replay in replays if replay[1] not in bands.replays]
+    added = 0
+    for i, ((replay_file, _), (replay_hash, samples, error)) in enumerate(zip(new, ordered_map(partial(replay_samples, player=player, event_cache=event_cache), new, jobs))):
+        print(f"processing: {(i+1)/len(new)*100:.1f}%\r", end = "")
+        if error is not None:
+            print(f"skipped {replay_file}: {error}")
+            continue
+        bands.add(replay_hash, samples)
+        added += 1
+
+    return added
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
+    parser.add_argument('-p', '--player', type=str, required=True, dest='player', action='store', help='player whose games make up the corpus')
+    parser.add_argument('-m', '--matchup', type=str, nargs='+', default=MATCHUPS, dest='matchups', action='store', help=f"matchups to build bands of (default: {' '.join(MATCHUPS)})")
+    parser.add_argument('-d', '--replays-dir', type=str, default=replays_dir, dest='replays_dir', action='store', help='replay search path')
+    parser.add_argument('-j', '--jobs', type=int, default=1, dest='jobs', action='store', help='number of worker processes parsing replays in parallel')
+    parser.add_argument('--no-event-cache', dest='use_event_cache', action='store_false', help=f'always decode replays, ignoring (and not updating) the decoded event cache in {cache_dir}')
+
+    args = parser.parse_args()
+
+    index = ReplayIndex()
+    index.update(args.replays_dir, args.jobs)
+    # hashed as they were indexed, so that finding the new replays doesn't read the whole archive
+    hashes = index.hashes()
+    event_cache = EventCache(os.path.join(cache_dir, 'events')) if args.use_event_cache else None
+
+    for matchup in args.matchups:
+        path = bands_path(args.player, matchup)
+        bands = CorpusBands.load(path)
+        added = update(bands, [(path, hashes[path]) for path in index.query(args.replays_dir, args.player, matchup)], args.player, args.jobs, event_cache)
+        bands.save(path)
+        print(f"{matchup}: {added} new replays, {len(bands.replays)} in total")
+
+    if event_cache is not None:
+        event_cache.evict()
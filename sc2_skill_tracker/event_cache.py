@@ -0,0 +1,264 @@
+"""
+Decoded replay events, cached on disk so that replays are only decoded by sc2reader once - re-running trackers over an
+archive (e.g. after a tracker changed, invalidating the result cache) replays the events from the cache instead.
+
+Only events (and fields) the trackers use are kept. Per replay (by content hash) there are two files:
+    <hash>.npy    events as a NumPy structured array (EVENT_FIELDS), memory mapped when read
+    <hash>.json   strings the events refer to (event class, unit type, upgrade and ability names), players, length
+
+Events come back as instances of the real sc2reader event classes (so that isinstance checks and dispatch behave as
+with decoded replays), with just the cached fields filled in, see CachedReplay.events().
+
+    python -m sc2_skill_tracker.event_cache     # decode all replays that aren't cached yet
+
+Bump VERSION whenever trackers start using events or fields that aren't cached.
+"""
+
+import argparse
+import json
+import os
+
+from .file_helpers import atomic_write, evict_lru
+from .parallel import ordered_map
+from .replay_helpers import replays_dir, cache_dir, file_hash, ReplaySession
+
+VERSION = 1
+
+DEFAULT_MAX_SIZE = 1024 * 1024 * 1024 # bytes
+
+# NumPy dtype of the events array - plain type codes, so that importing this module doesn't import NumPy
+EVENT_FIELDS = [('kind', 'i4'), # index of the event's class name in the string table
+                ('frame', 'i4'),
+                ('player', 'i2'), # pid of the event's player or unit owner, -1 for none
+                ('unit_id', 'i8'),
+                ('unit_type', 'i4'), # string index, the unit's type at the end of the replay
+                ('name', 'i4'), # string index: unit_type_name, upgrade_type_name or ability_name
+                ('target_unit_id', 'i8'),
+                ('food_used', 'f4'),
+                ('food_made', 'f4'),
+                ('minerals_current', 'i4'),
+                ('vespene_current', 'i4'),
+                ('minerals_lost', 'i4'),
+                ('minerals_used_current', 'i4')]
+
+STATS_FIELDS = ['food_used', 'food_made', 'minerals_current', 'vespene_current', 'minerals_lost', 'minerals_used_current']
+
+
+def _event_classes():
+    """ Event classes the trackers use (subclasses included), by what they carry """
+    from sc2reader.events import (PlayerStatsEvent, UnitBornEvent, UnitDoneEvent, UnitDiedEvent, UnitTypeChangeEvent,
+                                  UpgradeCompleteEvent, TargetUnitCommandEvent, PlayerLeaveEvent)
+    return {'stats': PlayerStatsEvent, 'type_change': UnitTypeChangeEvent, 'unit': (UnitBornEvent, UnitDoneEvent, UnitDiedEvent),
+            'upgrade': UpgradeCompleteEvent, 'command': TargetUnitCommandEvent, 'player': PlayerLeaveEvent}
+
+
+def _role(event_class, classes):
+    for role, base in classes.items():
+        if issubclass(event_class, base):
+            return role
+    return None
+
+
+def _classes_by_name(classes):
+    """ Event classes of _event_classes() and all their subclasses, by name """
+    by_name = {}
+    pending = [base for bases in classes.values() for base in (bases if isinstance(bases, tuple) else (bases,))]
+    while pending:
+        event_class = pending.pop()
+        by_name[event_class.__name__] = event_class
+        pending += event_class.__subclasses__()
+    return by_name
+
+
+class CachedPlayer(object):
+    """ Stands in for sc2reader's Player """
+    def __init__(self, pid, name, play_race, is_human):
+        self.pid = pid
+        self.name = name
+        self.play_race = play_race
+        self.is_human = is_human
+
+
+class CachedUnit(object):
+    """ Stands in for sc2reader's Unit - name is the unit's type at the end of the replay, like in sc2reader """
+    def __init__(self, unit_id, name, owner):
+        self.id = unit_id
+        self.name = name
+        self.owner = owner
+
+
+class CachedReplay(object):
+    def __init__(self, events, strings, players, frames):
+        """ :param events: NumPy array of EVENT_FIELDS, in time order (tracker events first on ties) """
+        self.array = events
+        self.strings = strings
+        self.players = players
+        self.frames = frames
+
+
+    @staticmethod
+    def decode(replay_file):
+        """ Decodes the replay with sc2reader """
+        import numpy as np
+
+        session = ReplaySession(replay_file)
+        classes = _event_classes()
+        strings = {}
+        def string(value):
+            return strings.setdefault(value, len(strings))
+
+        rows = []
+        for event in session.events():
+            role = _role(type(event), classes)
+            if role is None:
+                continue
+
+            unit = getattr(event, 'unit', None) if role in ('unit', 'type_change') else None
+            owner = unit.owner if unit is not None else getattr(event, 'player', None)
+            row = [string(type(event).__name__), event.frame, owner.pid if owner is not None else -1,
+                   unit.id if unit is not None else -1, string(unit.name) if unit is not None else -1, -1, -1] + [0] * len(STATS_FIELDS)
+
+            if role == 'stats':
+                row[7:] = [getattr(event, field) for field in STATS_FIELDS]
+            elif role == 'type_change':
+                row[5] = string(event.unit_type_name)
+            elif role == 'upgrade':
+                row[5] = string(event.upgrade_type_name)
+            elif role == 'command':
+                # the ability is only there if sc2reader recognised it - trackers check for that
+                row[5] = string(event.ability_name) if hasattr(event, 'ability') else -1
+                row[6] = event.target_unit_id
+            rows.append(tuple(row))
+
+        players = [CachedPlayer(player.pid, player.name, player.play_race, player.is_human) for player in session.players]
+        return CachedReplay(np.array(rows, dtype=EVENT_FIELDS), list(strings), players, session.details.frames)
+
+
+    def events(self, until=None):
+        """ Yields events in time order, like ReplaySession.events()
+            :param until: only events before this frame, None for all of them
+        """
+        import numpy as np
+
+        classes = _event_classes()
+        classes_by_name = _classes_by_name(classes)
+        kinds = {}
+        for index, name in enumerate(self.strings):
+            event_class = classes_by_name.get(name)
+            if event_class is not None:
+                kinds[index] = (event_class, _role(event_class, classes))
+
+        players = {player.pid: player for player in self.players}
+        units = {}
+        # only the rows until the cutoff are read from the (memory mapped) array, a column at a time - much faster than
+        # row by row
+        rows = self.array if until is None else self.array[:np.searchsorted(self.array['frame'], until, side='left')]
+        columns = [rows[field].tolist() for field, _ in EVENT_FIELDS]
+        for kind, frame, pid, unit_id, unit_type, name, target_unit_id, *stats in zip(*columns):
+            try:
+                event_class, role = kinds[kind]
+            except KeyError:
+                continue # an event class this version of sc2reader doesn't have
+
+            event = event_class.__new__(event_class) # skipping sc2reader's constructors - they parse raw replay data
+            attributes = {'frame': frame, 'second': frame >> 4}
+            if role in ('unit', 'type_change'):
+                unit = units.get(unit_id)
+                if unit is None:
+                    unit = units[unit_id] = CachedUnit(unit_id, self.strings[unit_type], players.get(pid))
+                attributes.update(unit=unit, unit_id=unit_id)
+                if role == 'type_change':
+                    attributes['unit_type_name'] = self.strings[name]
+            else:
+                attributes['player'] = players.get(pid)
+                if role == 'stats':
+                    attributes.update(zip(STATS_FIELDS, stats))
+                elif role == 'upgrade':
+                    attributes['upgrade_type_name'] = self.strings[name]
+                elif role == 'command':
+                    attributes['target_unit_id'] = target_unit_id
+                    if name >= 0:
+                        # only its presence is cached, trackers go by ability_name
+                        attributes.update(ability=None, ability_name=self.strings[name])
+
+            event.__dict__.update(attributes)
+            yield event
+
+
+class EventCache(object):
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+
+    def _path(self, replay_hash, extension):
+        # fan out into subdirectories so that no single directory gets thousands of entries
+        return os.path.join(self.directory, f'v{VERSION}', replay_hash[:2], f'{replay_hash}.{extension}')
+
+
+    def load(self, replay_file):
+        """ Returns the CachedReplay of the replay file, decoding (and caching) it if it isn't cached yet """
+        import numpy as np
+
+        replay_hash = file_hash(replay_file)
+        try:
+            with open(self._path(replay_hash, 'json')) as f:
+                metadata = json.load(f)
+            events = np.load(self._path(replay_hash, 'npy'), mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            # a missing or half-written entry is a cache miss
+            replay = CachedReplay.decode(replay_file)
+            self._store(replay_hash, replay)
+            return replay
+
+        os.utime(self._path(replay_hash, 'json')) # mark as recently used
+        players = [CachedPlayer(**player) for player in metadata['players']]
+        return CachedReplay(events, metadata['strings'], players, metadata['frames'])
+
+
+    def _store(self, replay_hash, replay):
+        import numpy as np
+
+        # events first - readers go by the metadata file
+        with atomic_write(self._path(replay_hash, 'npy'), 'wb') as f:
+            np.save(f, replay.array)
+        with atomic_write(self._path(replay_hash, 'json')) as f:
+            json.dump({'strings': replay.strings, 'frames': replay.frames,
+                       'players': [vars(player) for player in replay.players]}, f)
+
+
+    def evict(self):
+        """ Deletes least recently used replays (both of their files) until the cache fits in max_size """
+        evict_lru(self.directory, self.max_size, lambda name: os.path.splitext(name)[0])
+
+
+def decode_replay(replay_file, event_cache):
+    """ Returns an error message or None """
+    try:
+        event_cache.load(replay_file)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return None
+
+
+if __name__ == '__main__':
+    from functools import partial
+    from .replay_index import ReplayIndex
+
+    parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
+    parser.add_argument('-d', '--replays-dir', type=str, default=replays_dir, dest='replays_dir', action='store', help='replay search path')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), dest='jobs', action='store', help='number of worker processes decoding replays in parallel')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024), dest='cache_size', action='store', help='event cache size limit in MB')
+
+    args = parser.parse_args()
+
+    index = ReplayIndex()
+    index.update(args.replays_dir, args.jobs)
+    replays = [path for path, _, error in index.recent(args.replays_dir) if error is None]
+
+    event_cache = EventCache(os.path.join(cache_dir, 'events'), args.cache_size * 1024 * 1024)
+    for i, (replay_file, error) in enumerate(zip(replays, ordered_map(partial(decode_replay, event_cache=event_cache), replays, args.jobs))):
+        print(f"decoding: {(i+1)/len(replays)*100:.1f}%\r", end = "")
+        if error is not None:
+            print(f"skipped {replay_file}: {error}")
+    event_cache.evict()
@@ -0,0 +1,58 @@
+"""
+Routes replay events only to the trackers interested in them, instead of offering every event to every tracker.
+
+Trackers declare interest with an EVENT_TYPES class attribute - a tuple of event classes (subclasses included).
+Trackers without one get every event. A tracker can narrow it down further with a player_ids attribute (a set of
+player IDs, None for any player), in which case it only gets events of units/players with those IDs.
+"""
+
+from . import profiling
+
+
+def event_player_id(event):
+    """ Returns ID of the player owning the event's unit, or of the event's player, None if there's neither """
+    unit = getattr(event, 'unit', None)
+    if unit is not None:
+        return unit.owner.pid if unit.owner is not None else None
+
+    player = getattr(event, 'player', None)
+    return player.pid if player is not None else None
+
+
+class EventDispatcher(object):
+    def __init__(self, trackers):
+        self.trackers = trackers
+        # event class -> [(consume_event, player_ids)] of trackers interested in it, filled in as event classes
+        # are first seen (there's only a few dozen of them)
+        self.routes = {}
+
+
+    def _route(self, event_type):
+        route = []
+        for tracker in self.trackers:
+            event_types = getattr(tracker, 'EVENT_TYPES', None)
+            if event_types is None or issubclass(event_type, event_types):
+                route.append((profiling.profiler.tracker_callback(tracker, tracker.consume_event),
+                              getattr(tracker, 'player_ids', None)))
+
+        return route
+
+
+    def dispatch(self, event):
+        try:
+            route = self.routes[type(event)]
+        except KeyError:
+            route = self.routes[type(event)] = self._route(type(event))
+
+        player_id = None
+        player_id_known = False
+        for consume_event, player_ids in route:
+            if player_ids is not None:
+                # resolved once per event, however many trackers filter by it
+                if not player_id_known:
+                    player_id = event_player_id(event)
+                    player_id_known = True
+                if player_id not in player_ids:
+                    continue
+
+            consume_event(event)
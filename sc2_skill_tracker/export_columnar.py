@@ -0,0 +1,162 @@
+"""
+Exports tracker samples of many replays to columnar files, for analysis in pandas, DuckDB etc. without parsing
+replays again. Requires pyarrow (pip install pyarrow).
+
+Every table gets one file per replay, partitioned by the month the replay was saved:
+
+    <output dir>/<table>/month=<yyyy-mm>/<replay hash>.<arrow|parquet>
+
+Tables (all with replay and player columns, one row per sample of every Zerg player, times in game seconds):
+    resources   LarvaeVsResourcesTracker samples: time, supply_used, supply_cap, minerals, gas, larvae
+    drones      DroneTracker samples: time, drones
+    upgrades    time, name
+    injects     hatchery (by creation order), kind (injected or missed), start, end
+
+Replays already exported are skipped, so the export can be re-run as new replays arrive. Arrow IPC files (the default)
+can be memory mapped, e.g. pyarrow.dataset.dataset('<output dir>/drones', format='arrow', partitioning='hive').
+"""
+
+import argparse
+import itertools
+import os
+import time
+
+from functools import partial
+
+import numpy as np
+
+from .event_cache import EventCache
+from .file_helpers import atomic_write
+from .parallel import ordered_map
+from .plotter import consume_replay
+from .replay_helpers import replays_dir, cache_dir, discover_players, ReplaySession
+from .replay_index import ReplayIndex
+from .SC2SkillTrackerException import SC2SkillTrackerException
+from .trackers.DroneTracker import DroneTracker
+from .trackers.InjectTracker import InjectTracker
+from .trackers.LarvaeVsResourcesTracker import LarvaeVsResourcesTracker
+from .trackers.UpgradeTracker import UpgradeTracker
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+# written in this order - a replay with the last table is fully exported
+TABLES = ['resources', 'drones', 'upgrades', 'injects']
+FORMATS = ['arrow', 'parquet']
+
+
+def table_path(output_dir, table, replay_file, replay_hash, fmt):
+    month = time.strftime('%Y-%m', time.localtime(os.path.getctime(replay_file)))
+    return os.path.join(output_dir, table, f'month={month}', f'{replay_hash}.{fmt}')
+
+
+def player_columns(resources, drones, upgrades, injects, cutoff):
+    """ Returns {table: {column: values}} of one player's trackers """
+    intervals = injects.inject_intervals(cutoff)
+    injected, missed = intervals['injects'], intervals['missed']
+
+    return {'resources': {column: resources.data[column] for column in resources.data.columns},
+            'drones': {column: drones.data[column] for column in drones.data.columns},
+            'upgrades': {'time': np.array([upgrade['time'] for upgrade in upgrades.upgrades], dtype=np.int32),
+                         'name': [upgrade['name'] for upgrade in upgrades.upgrades]},
+            'injects': {'hatchery': np.concatenate([injected[0], missed[0]]).astype(np.int32),
+                        'kind': ['injected'] * len(injected[0]) + ['missed'] * len(missed[0]),
+                        'start': np.concatenate([injected[1], missed[1]]),
+                        'end': np.concatenate([injected[2], missed[2]])}}
+
+
+def arrow_table(replay_hash, players):
+    """ Concatenates columns of all players into one table
+        :param players: list of (player name, {column: values})
+    """
+    lengths = [len(next(iter(columns.values()))) for _, columns in players]
+    arrays = {'replay': pa.array([replay_hash] * sum(lengths), pa.string()),
+              'player': pa.array([name for (name, _), length in zip(players, lengths) for _ in range(length)], pa.string())}
+
+    for column in players[0][1]:
+        values = [columns[column] for _, columns in players]
+        if isinstance(values[0], np.ndarray):
+            arrays[column] = pa.array(np.concatenate(values))
+        else:
+            arrays[column] = pa.array(list(itertools.chain(*values)), pa.string())
+
+    return pa.table(arrays)
+
+
+def write_table(table, path, fmt):
+    with atomic_write(path, 'wb') as f:
+        if fmt == 'parquet':
+            pq.write_table(table, f)
+        else:
+            with pa.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+
+
+def export_replay(replay, output_dir, fmt, event_cache=None):
+    """ Returns an error message or None
+        :param replay: (replay file, replay hash)
+    """
+    replay_file, replay_hash = replay
+    try:
+        session = ReplaySession(replay_file, event_cache)
+        zerg_names = [player.name for player in discover_players(session) if player.play_race == "Zerg"]
+        if len(zerg_names) == 0:
+            raise SC2SkillTrackerException("No Zerg players found")
+
+        player_trackers = {name: [LarvaeVsResourcesTracker(name), DroneTracker(name), UpgradeTracker(name), InjectTracker(name)]
+                           for name in zerg_names}
+        cutoff = consume_replay(session, list(itertools.chain(*player_trackers.values())))
+
+        columns = {name: player_columns(*trackers, cutoff) for name, trackers in player_trackers.items()}
+        for table in TABLES:
+            write_table(arrow_table(replay_hash, [(name, columns[name][table]) for name in zerg_names]),
+                        table_path(output_dir, table, replay_file, replay_hash, fmt), fmt)
+    except SC2SkillTrackerException as e:
+        return str(e)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+    return None
+
+
+def run(directory, output_dir, fmt, player, matchup, jobs, use_event_cache=True):
+    if pa is None:
+        raise SC2SkillTrackerException("Columnar export requires pyarrow (pip install pyarrow)")
+
+    index = ReplayIndex()
+    index.update(directory, jobs)
+    # hashed as they were indexed (update() re-reads replays whose mtime or size changed), so that finding the new
+    # replays doesn't read the whole archive
+    hashes = index.hashes()
+    replays = [(path, hashes[path]) for path in index.query(directory, player, matchup)]
+    new = [(path, replay_hash) for path, replay_hash in replays
+           if not os.path.isfile(table_path(output_dir, TABLES[-1], path, replay_hash, fmt))]
+    print(f"{len(replays) - len(new)} of {len(replays)} replays already exported")
+
+    event_cache = EventCache(os.path.join(cache_dir, 'events')) if use_event_cache else None
+    export = partial(export_replay, output_dir=output_dir, fmt=fmt, event_cache=event_cache)
+    for i, ((replay_file, _), error) in enumerate(zip(new, ordered_map(export, new, jobs))):
+        print(f"exporting: {(i+1)/len(new)*100:.1f}%\r", end = "")
+        if error is not None:
+            print(f"skipped {replay_file}: {error}")
+
+    if event_cache is not None:
+        event_cache.evict()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
+    parser.add_argument('-o', '--output-dir', type=str, required=True, dest='output_dir', action='store', help='directory to write tables to')
+    parser.add_argument('-f', '--format', type=str, default='arrow', choices=FORMATS, dest='format', action='store', help='file format, Arrow IPC (can be memory mapped) or Parquet')
+    parser.add_argument('-d', '--replays-dir', type=str, default=replays_dir, dest='replays_dir', action='store', help='replay search path')
+    parser.add_argument('-p', '--player', type=str, dest='player', action='store', help='only games with this player')
+    parser.add_argument('-m', '--matchup', type=str, dest='matchup', action='store', help="only games of this matchup, e.g. ZvT (player's race first, requires --player)")
+    parser.add_argument('-j', '--jobs', type=int, default=1, dest='jobs', action='store', help='number of worker processes parsing replays in parallel')
+    parser.add_argument('--no-event-cache', dest='use_event_cache', action='store_false', help=f'always decode replays, ignoring (and not updating) the decoded event cache in {cache_dir}')
+
+    args = parser.parse_args()
+
+    run(args.replays_dir, args.output_dir, args.format, args.player, args.matchup, args.jobs, args.use_event_cache)
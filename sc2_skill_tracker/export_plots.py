@@ -0,0 +1,100 @@
+"""
+Renders plots of many replays to image files, without any windows (e.g. for reports generated overnight). Replays
+whose images are newer than the replay file are skipped, so the export can be re-run on a growing set of replays.
+
+Images are written as <output dir>/<replay name>[-<cutoff>].<n>.<format>, one per Zerg player (n from 0).
+"""
+
+import matplotlib
+matplotlib.use('Agg') # before anything imports pyplot - headless, also in worker processes
+
+import argparse
+import glob
+import os
+
+from functools import partial
+
+from .parallel import ordered_map
+from .plotter import PLOT_TRACKERS, generate_plots
+from .replay_helpers import replays_dir, parse_timestamp, timestamp, real_seconds
+from .SC2SkillTrackerException import SC2SkillTrackerException
+
+
+def output_stem(replay_file, output_dir, cutoff):
+    stem = os.path.splitext(os.path.basename(replay_file))[0]
+    if cutoff is not None:
+        stem += '-' + timestamp(real_seconds(cutoff)).replace(':', 'm') + 's'
+    return os.path.join(output_dir, stem)
+
+
+def is_up_to_date(replay_file, output_dir, cutoff, formats):
+    # the first player's images are written last-to-first, so if they're there, so are the others
+    for fmt in formats:
+        path = f'{output_stem(replay_file, output_dir, cutoff)}.0.{fmt}'
+        if not os.path.isfile(path) or os.path.getmtime(path) < os.path.getmtime(replay_file):
+            return False
+
+    return True
+
+
+def export_replay(replay_file, output_dir, cutoff, formats, tracker_names):
+    """ Returns paths of the written images, or an error message """
+    try:
+        figures = generate_plots(replay_file, cutoff, use_pyplot=False, tracker_names=tracker_names)
+
+        paths = []
+        # the first figure goes last, see is_up_to_date()
+        for i, figure in reversed(list(enumerate(figures))):
+            for fmt in formats:
+                path = f'{output_stem(replay_file, output_dir, cutoff)}.{i}.{fmt}'
+                figure.savefig(path, format=fmt)
+                paths.append(path)
+    except SC2SkillTrackerException as e:
+        return str(e)
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+    return paths
+
+
+def find_replays(patterns):
+    """ Expands paths and glob patterns, also relative to the replays directory """
+    replays = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if not matches and replays_dir is not None:
+            matches = sorted(glob.glob(os.path.join(replays_dir, pattern)))
+        if not matches:
+            print(f"No replays match: {pattern}")
+        replays += [path for path in matches if os.path.isfile(path)]
+
+    return replays
+
+
+def run(patterns, output_dir, cutoff, formats, tracker_names, jobs):
+    os.makedirs(output_dir, exist_ok=True)
+
+    replays = find_replays(patterns)
+    outdated = [replay for replay in replays if not is_up_to_date(replay, output_dir, cutoff, formats)]
+    print(f"{len(replays) - len(outdated)} of {len(replays)} replays up to date")
+
+    export = partial(export_replay, output_dir=output_dir, cutoff=cutoff, formats=formats, tracker_names=tracker_names)
+    for (i, (replay_file, result)) in enumerate(zip(outdated, ordered_map(export, outdated, jobs))):
+        print(f"exporting: {(i+1)/len(outdated)*100:.1f}%\r", end = "")
+        if isinstance(result, str):
+            print(f"skipped {replay_file}: {result}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
+    parser.add_argument('replays', nargs='+', help='replay files or glob patterns (absolute or relative to replay search path), e.g. "*.SC2Replay"')
+    parser.add_argument('-o', '--output-dir', type=str, required=True, dest='output_dir', action='store', help='directory to write images to')
+    parser.add_argument('-u', '--until', type=parse_timestamp, dest='cutoff', action='store', help='cutoff time in format mm:ss')
+    parser.add_argument('-f', '--formats', type=str, default='png', dest='formats', action='store', help='comma separated image formats, e.g. png,svg')
+    parser.add_argument('-t', '--trackers', type=str, dest='trackers', action='store', help=f'comma separated trackers to plot, all by default ({", ".join(PLOT_TRACKERS)})')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), dest='jobs', action='store', help='number of worker processes rendering plots')
+
+    args = parser.parse_args()
+
+    run(args.replays, args.output_dir, args.cutoff, args.formats.split(','),
+        args.trackers.split(',') if args.trackers else None, args.jobs)
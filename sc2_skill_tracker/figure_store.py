@@ -0,0 +1,56 @@
+"""
+Rendered replay figures stored on disk, by replay content hash and cutoff, so that a replay rendered once (e.g. by the
+watch daemon) can be viewed again without parsing it.
+"""
+
+import os
+import shutil
+import tempfile
+
+from .plotter import generate_plots
+
+
+def cutoff_key(cutoff):
+    return 'full' if cutoff is None else f'{cutoff:g}'
+
+
+class FigureStore(object):
+    def __init__(self, directory):
+        self.directory = directory
+
+
+    def _dir(self, replay_hash, cutoff, fmt):
+        return os.path.join(self.directory, replay_hash[:2], replay_hash, cutoff_key(cutoff), fmt)
+
+
+    def get(self, replay_hash, cutoff=None, fmt='png'):
+        """ Returns paths of stored figures (one per Zerg player), None if the replay wasn't rendered """
+        directory = self._dir(replay_hash, cutoff, fmt)
+        if not os.path.isdir(directory):
+            return None
+
+        paths = sorted(os.path.join(directory, name) for name in os.listdir(directory))
+        return paths or None
+
+
+    def render(self, replay_file, replay_hash, cutoff=None, fmt='png', event_cache=None, riders=None):
+        """ Renders the replay's figures into the store and returns their paths
+            :param event_cache: EventCache to take the replay's events from (and to add them to)
+            :param riders: trackers to consume along with the plotted ones, see generate_plots()
+        """
+        directory = self._dir(replay_hash, cutoff, fmt)
+        os.makedirs(os.path.dirname(directory), exist_ok=True)
+
+        # render into a temporary directory and move it in place, so that readers never see a partial set
+        tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(directory), suffix='.tmp')
+        try:
+            for i, figure in enumerate(generate_plots(replay_file, cutoff, use_pyplot=False, event_cache=event_cache, riders=riders)):
+                figure.savefig(os.path.join(tmp_dir, f'{i}.{fmt}'), format=fmt)
+        except BaseException:
+            # e.g. not a Zerg game, or a replay that's still being written - don't leave the half-rendered set behind
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(tmp_dir, directory)
+        return self.get(replay_hash, cutoff, fmt)
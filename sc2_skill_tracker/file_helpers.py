@@ -0,0 +1,51 @@
+import os
+import tempfile
+
+from contextlib import contextmanager
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    """ Opens a temporary file next to path (creating the directory) and moves it in place once the block completes,
+        so that readers never see a partially written file. The temporary file is removed if the block raises.
+        :param mode: 'w' or 'wb'
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def evict_lru(directory, max_size, entry_of=None):
+    """ Deletes the least recently modified entries of a cache directory (recursively) until it fits in max_size
+        :param entry_of: returns the entry a file name belongs to, entries of several files go (and are aged by their
+                         most recent file) together. Every file is its own entry if None.
+    """
+    if not os.path.isdir(directory):
+        return
+
+    # entry -> [last modified, size, paths]
+    entries = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            entry = entries.setdefault(path if entry_of is None else entry_of(name), [0, 0, []])
+            entry[0] = max(entry[0], stat.st_mtime)
+            entry[1] += stat.st_size
+            entry[2].append(path)
+
+    total_size = sum(size for _, size, _ in entries.values())
+    for _, size, paths in sorted(entries.values()):
+        if total_size <= max_size:
+            break
+        for path in paths:
+            os.remove(path)
+        total_size -= size
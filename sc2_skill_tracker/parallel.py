@@ -0,0 +1,28 @@
+import itertools
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+
+def ordered_map(function, items, jobs=1):
+    """ Like map(), but spreads the calls over a pool of `jobs` worker processes (no pool at all if jobs <= 1).
+        Results are yielded in the order of items, and items are only taken as results are consumed (a few ahead to
+        keep the workers busy), so the caller can stop early without processing everything.
+        :param function: must be picklable, i.e. a module-level function (or functools.partial of one)
+    """
+    if jobs <= 1:
+        yield from map(function, items)
+        return
+
+    items = iter(items)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        pending = deque(executor.submit(function, item) for item in itertools.islice(items, 2 * jobs))
+        try:
+            while pending:
+                result = pending.popleft().result()
+                pending.extend(executor.submit(function, item) for item in itertools.islice(items, 1))
+                yield result
+        finally:
+            # the caller stopped early - don't start work nobody will look at
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,43 @@
+"""
+Draws many rectangles as a single matplotlib collection - one artist per category instead of one per interval, which
+keeps building and drawing figures of long games fast.
+"""
+
+import numpy as np
+
+from matplotlib.collections import PolyCollection
+
+
+def runs(mask):
+    """ Returns arrays start, end (exclusive) of the indices of runs of consecutive True values in mask """
+    edges = np.diff(np.concatenate([[0], np.asarray(mask, dtype=np.int8), [0]]))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def rectangles(x0, x1, y0, y1):
+    """ Returns vertices of rectangles (x0, y0)-(x1, y1), shape (n, 4, 2) - arguments are broadcast """
+    x0, x1, y0, y1 = np.broadcast_arrays(x0, x1, y0, y1)
+    corners = [(x0, y0), (x0, y1), (x1, y1), (x1, y0)]
+    return np.stack([np.stack(corner, axis=-1) for corner in corners], axis=-2).reshape(-1, 4, 2)
+
+
+def add_bars(axes, x0, x1, y0, y1, **kwargs):
+    """ Like a broken_barh() call per rectangle, in data coordinates
+        :param kwargs: PolyCollection properties, e.g. facecolors, alpha
+    """
+    collection = PolyCollection(rectangles(x0, x1, y0, y1), **kwargs)
+    axes.add_collection(collection)
+    axes.autoscale_view()
+    return collection
+
+
+def add_vspans(axes, x0, x1, **kwargs):
+    """ Like an axvspan() call per span - x in data coordinates, spanning the whole height of the axes
+        :param kwargs: PolyCollection properties, e.g. color, alpha
+    """
+    vertices = rectangles(x0, x1, 0, 1)
+    collection = PolyCollection(vertices, transform=axes.get_xaxis_transform(), **kwargs)
+    # y is in axes coordinates, only x may extend the data limits
+    axes.add_collection(collection, autolim=False)
+    axes.update_datalim(vertices.reshape(-1, 2), updatey=False)
+    return collection
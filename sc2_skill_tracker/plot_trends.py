@@ -1,128 +1,312 @@
 """
 Plots values and trends for various statistics over a number of replays
+
+Trends are kept up to date in trend states (see trend_state.py) stored in the cache directory, so after a game only
+its replay is parsed.
 """
 
 import os
 import argparse
+import gc
 
-import matplotlib.pyplot as plt
-from matplotlib.ticker import FuncFormatter
-
-import numpy as np
-from numpy.polynomial import Polynomial
-
-from pathlib import Path
+from functools import partial
 
-from .plotter import consume_replay
-from .replay_helpers import replays_dir, parse_timestamp
-from .trackers.LarvaeVsResourcesTracker import LarvaeVsResourcesTracker
-from .trackers.InjectTracker import InjectTracker
+from . import profiling
+from .parallel import ordered_map
+from .plotter import consume_replay_checkpoints
+from .replay_index import ReplayIndex
+from .replay_helpers import replays_dir, cache_dir, parse_timestamp, timestamp, real_seconds, file_hash, ReplaySession
+from .event_cache import EventCache
+from .result_cache import ResultCache, DEFAULT_MAX_SIZE
+from .trend_state import TrendState
 
 
-def plot_data_with_trends(axes, data):
-        x = range(len(data))
-        y = list(data)
+def plot_data_with_trends(axes, state):
+        """ Plots the data points in the state's overall window, and its overall and recent trend lines (fitted
+            already, as the state was updated)
+        """
+        x, y = zip(*state.overall.points)
         axes.plot(x, y)
 
-        overall_trend = Polynomial.fit(x, y, deg=1) # fit the trend line (degree 1 polynomial)
-        axes.plot(x, overall_trend(x))
+        for window in [state.overall, state.recent]:
+            line = window.line()
+            if line is not None:
+                intercept, slope = line
+                ends = [window.points[0][0], window.points[-1][0]]
+                axes.plot(ends, [intercept + slope * end for end in ends])
 
-        recent_trend = Polynomial.fit(x[-args.recent_trend:], y[-args.recent_trend:], deg=1)
-        axes.plot(x[-args.recent_trend:], recent_trend(x[-args.recent_trend:]))
 
+class Trend(object):
+    """ Base for trends - subclasses implement create_tracker(), measure(), which turns the tracker that consumed
+        a replay into a data point (or None if the replay should be skipped), and plot()
+    """
+    # bump in a subclass whenever its measurement (or the trackers it uses) changes - invalidates cached results
+    VERSION = 1
 
-class LarvaSpendingTrend(object):
     def __init__(self, cutoff, player):
         self.cutoff = cutoff
-        self.averages = []
         self.player = player
 
 
-    def consume_replay(self, replay):
-        tracker = LarvaeVsResourcesTracker(self.player)
-        actual_cutoff = consume_replay(replay, [tracker], self.cutoff)
+    def tracker_key(self):
+        """ Trends with the same key can measure the same tracker (at their own cutoffs) """
+        return type(self), self.player
+
+
+    def cache_key(self, cache, replay_hash):
+        return cache.key(replay_hash, type(self).__name__, self.VERSION, self.cutoff, self.player)
+
+
+    def state_path(self, directory, *filters):
+        """ Path of the trend's state - one per metric, player and cutoff, and whatever else selects the replays """
+        key = ResultCache.key(type(self).__name__, self.VERSION, self.cutoff, self.player, *filters)
+        return os.path.join(directory, key + '.json')
+
+
+class TrendEngine(object):
+    """ Measures any number of trends with a single load of each replay - every trend only contributes its tracker
+        to the one event stream (per cutoff)
+    """
+    def __init__(self, trends, cache=None, event_cache=None):
+        self.trends = trends
+        self.cache = cache
+        self.event_cache = event_cache
+
+
+    def riders(self, trends):
+        """ Returns (trackers, cutoffs, checkpoint, data_points) that measure the given trends in a pass over a replay's
+            events, see consume_replay_checkpoints() - trends of the same kind (and player) share a tracker, which
+            they measure as it reaches their cutoffs, into data_points {trend: data point}
+            :return: trackers by Trend.tracker_key()
+        """
+        trackers = {}
+        for trend in trends:
+            if trend.tracker_key() not in trackers:
+                trackers[trend.tracker_key()] = trend.create_tracker()
+
+        data_points = {}
+        def checkpoint(cutoff, actual_cutoff):
+            for trend in trends:
+                if trend.cutoff == cutoff:
+                    data_points[trend] = trend.measure(trackers[trend.tracker_key()], actual_cutoff)
+
+        return trackers, set(trend.cutoff for trend in trends), checkpoint, data_points
+
+
+    def measure(self, replay, trends):
+        """ Returns data points of the given trends, in a single pass over the replay's events whatever their cutoffs """
+        trackers, cutoffs, checkpoint, data_points = self.riders(trends)
+        session = ReplaySession(replay, self.event_cache)
+        try:
+            consume_replay_checkpoints(session, list(trackers.values()), cutoffs, checkpoint)
+        finally:
+            # only the data points are kept - the replay and the trackers go as soon as they're measured
+            session.close()
+            trackers.clear()
+            # sc2reader's replays are full of reference cycles (units, players and events refer to each other), which
+            # only the cyclic collector frees - left to itself, it lets them pile up over many replays
+            gc.collect()
+
+        return [data_points[trend] for trend in trends]
+
+
+    def lookup(self, replay, measured=None):
+        """ Returns data points of all trends for the replay (None for trends which skip it), only measuring the ones
+            that aren't cached
+            :param measured: {trend: data point} measured already, e.g. along with rendering the replay (see riders())
+        """
+        measured = dict(measured or {})
+        data_points = {}
+        if self.cache is not None:
+            replay_hash = file_hash(replay)
+            keys = {trend: trend.cache_key(self.cache, replay_hash) for trend in self.trends}
+            for trend in self.trends:
+                try:
+                    data_points[trend] = self.cache[keys[trend]]
+                except KeyError:
+                    pass
+
+        missing = [trend for trend in self.trends if trend not in data_points]
+        unmeasured = [trend for trend in missing if trend not in measured]
+        if unmeasured:
+            measured.update(zip(unmeasured, self.measure(replay, unmeasured)))
+        for trend in missing:
+            data_points[trend] = measured[trend]
+            if self.cache is not None:
+                self.cache[keys[trend]] = measured[trend]
+
+        return [data_points[trend] for trend in self.trends]
+
+
+    def update(self, states, replays, number_of_replays, jobs=1):
+        """ Adds data points of replays the trend states (one per trend) haven't seen yet - normally just the latest
+            ones, which are the only replays parsed (or looked up in the cache). Returns the number of replays added.
+            :param replays: newest first
+            :param number_of_replays: when (re)building the states, go back until this many replays were usable by all trends
+        """
+        chronological = replays[::-1]
+        pending = states[0].pending(chronological)
+        # the states have to agree, and to go back far enough - unless they start with the oldest replay there is
+        if any(state.seen() != states[0].seen() for state in states) \
+           or (pending is not None and min(state.count for state in states) < number_of_replays
+               and states[0].first_replay != chronological[0]):
+            pending = None
+
+        if pending is not None:
+            # streamed into the states as results come in - only the scalar data points outlive a replay
+            for replay, data_points in zip(pending, ordered_map(partial(lookup_trends, engine=self), pending, jobs)):
+                for state, data_point in zip(states, data_points):
+                    state.add(replay, data_point)
+            return len(pending)
+
+        # first run, or replays were deleted or older ones added - start over from the newest replays
+        for i, state in enumerate(states):
+            states[i] = TrendState(state.overall.size, state.recent.size)
+
+        # data points (just the scalars) are kept until they can be added in chronological order - as many as it
+        # takes to get number_of_replays usable replays
+        added = []
+        processed = 0
+        # results come back in the same (reverse chronological) order as replays, however many jobs there are
+        for replay, data_points in zip(replays, ordered_map(partial(lookup_trends, engine=self), replays, jobs)):
+            added.append((replay, data_points))
+            # a replay only counts towards the total if all trends consumed it successfully
+            if all(data_point is not None for data_point in data_points):
+                processed += 1
+            print(f"processing: {processed/number_of_replays*100:.1f}%\r", end = "")
+            if processed >= number_of_replays:
+                break
+        added.reverse()
 
+        for replay, data_points in added:
+            for state, data_point in zip(states, data_points):
+                state.add(replay, data_point)
+        return len(added)
+
+
+def lookup_trends(replay, engine):
+    """ Module-level so that it can run in worker processes """
+    with profiling.phase('lookup_trends', replay):
+        return engine.lookup(replay)
+
+
+class LarvaSpendingTrend(Trend):
+    def create_tracker(self):
+        # only imported when a replay has to be parsed, i.e. not when all results are cached
+        from .trackers.LarvaeVsResourcesTracker import LarvaeVsResourcesTracker
+        return LarvaeVsResourcesTracker(self.player)
+
+
+    def measure(self, tracker, actual_cutoff):
         # skip replays shorter than cutoff
         if actual_cutoff >= self.cutoff:
-            larvae_history = [event['larvae'] for event in tracker.data]
-            avg_unspent_larvae = sum(larvae_history) / len(tracker.data)
-            self.averages.append(avg_unspent_larvae)
-            return True
+            return float(tracker.data['larvae'].mean()) # average unspent larvae
         else:
-            return False
+            return None
 
 
-    def plot(self, axes, reverse):
-        plot_data_with_trends(axes, list(reversed(self.averages)) if reverse else self.averages)
+    def plot(self, axes, state):
+        plot_data_with_trends(axes, state)
 
 
-class InjectTrend(object):
-    def __init__(self, cutoff, player):
-        self.cutoff = cutoff
-        self.data_points = []
-        self.player = player
-
+class InjectTrend(Trend):
+    def create_tracker(self):
+        from .trackers.InjectTracker import InjectTracker
+        return InjectTracker(self.player)
 
-    def consume_replay(self, replay):
-        tracker = InjectTracker(self.player)
-        actual_cutoff = consume_replay(replay, [tracker], self.cutoff)
 
+    def measure(self, tracker, actual_cutoff):
         if actual_cutoff >= self.cutoff:
             inject_history = tracker.inject_history(0, actual_cutoff)
             assert(inject_history['hatch_cutoff'] <= actual_cutoff)
             # skip replays where the main hatchery died
             if inject_history['hatch_cutoff'] == actual_cutoff:
-                self.data_points.append(inject_history['proportion_injected'] * 100)
-                return True
+                return inject_history['proportion_injected'] * 100
             else:
-                return False
+                return None
         else:
-            return False
+            return None
 
 
-    def plot(self, axes, reverse):
+    def plot(self, axes, state):
+        from matplotlib.ticker import FuncFormatter
         axes.yaxis.set_major_formatter(FuncFormatter(lambda val, _: f'{val:.0f}%'))
-        plot_data_with_trends(axes, list(reversed(self.data_points)) if reverse else self.data_points)
+        plot_data_with_trends(axes, state)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
-    parser.add_argument('-n', '--number-of-replays', type=int, default=50, dest='number_of_replays', action='store', help='number of replays to process')
+    parser.add_argument('-n', '--number-of-replays', type=int, default=50, dest='number_of_replays', action='store', help='number of replays to process - only replays usable by all trends count (the overall trend is fitted over the last this many data points)')
     parser.add_argument('-r', '--recent-trend', type=int, default=15, dest='recent_trend', action='store', help='number of most recent replays to plot the short term trend over')
-    parser.add_argument('-c', '--cutoff-time', type=parse_timestamp, default='7:00', dest='cutoff', action='store', help='cutoff time for each replay in format mm:ss (cutting off before mid game should give a more useful signal)')
+    parser.add_argument('-c', '--cutoff-time', type=parse_timestamp, nargs='+', default=[parse_timestamp('7:00')], dest='cutoffs', action='store', help='cutoff times for each replay in format mm:ss (cutting off before mid game should give a more useful signal), e.g. -c 5:00 7:00 10:00 - all measured in one pass over each replay')
     parser.add_argument('-d', '--replays-dir', type=str, default=replays_dir, dest='replays_dir', action='store', help='replay search path')
     parser.add_argument('-p', '--player', type=str, default='orastem', dest='player', action='store', help='player to plot trends for')
+    parser.add_argument('--no-cache', dest='use_cache', action='store_false', help=f'always parse replays, ignoring (and not updating) the result cache and trend states in {cache_dir}')
+    parser.add_argument('-m', '--matchup', type=str, dest='matchup', action='store', help="only games of this matchup, e.g. ZvT (player's race first)")
+    parser.add_argument('--min-duration', type=parse_timestamp, dest='min_duration', action='store', help='only games at least this long, in format mm:ss (at least the cutoff time regardless)')
+    parser.add_argument('-j', '--jobs', type=int, default=1, dest='jobs', action='store', help='number of worker processes parsing replays in parallel')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_MAX_SIZE // (1024 * 1024), dest='cache_size', action='store', help='result cache size limit in MB')
 
-    args = parser.parse_args()
-
-    root = Path(args.replays_dir)
-    # reverse sort all replays by date
-    files = iter(sorted(root.iterdir(), key = lambda f: f.stat().st_ctime, reverse=True))
+    profiling.add_arguments(parser)
 
-    processed = 0
-    trends = [LarvaSpendingTrend(args.cutoff, args.player), InjectTrend(args.cutoff, args.player)]
-    while processed < args.number_of_replays:
-        try:
-            replay = str(next(files).resolve())
-            if all([trend.consume_replay(replay) for trend in trends]):
-                # a replay only counts towards the total if all trends consumed it successfully
-                # (could do it with any(), let's see how it goes)
-                processed += 1
-                print(f"processing: {(processed)/args.number_of_replays*100:.1f}%\r", end = "")
+    args = parser.parse_args()
+    profiling.enable_from_args(args)
+
+    # the index only opens replays it hasn't seen before, filtering happens without touching replays at all;
+    # replays shorter than the (shortest) cutoff would be skipped anyway
+    index = ReplayIndex()
+    with profiling.phase('index_update'):
+        index.update(args.replays_dir, args.jobs)
+    # reverse sorted by date
+    cutoffs = sorted(set(args.cutoffs))
+    min_duration = max(args.min_duration or 0, cutoffs[0])
+    replays = index.query(args.replays_dir, args.player, args.matchup, min_duration)
+
+    cache = ResultCache(os.path.join(cache_dir, 'results'), args.cache_size * 1024 * 1024) if args.use_cache else None
+
+    # metric by cutoff
+    trend_classes = [LarvaSpendingTrend, InjectTrend]
+    trends = [trend_class(cutoff, args.player) for trend_class in trend_classes for cutoff in cutoffs]
+    # decoded events are kept too, so that results invalidated by a new trend VERSION don't need replays decoded again
+    event_cache = EventCache(os.path.join(cache_dir, 'events')) if args.use_cache else None
+    engine = TrendEngine(trends, cache, event_cache)
+
+    state_paths = [trend.state_path(os.path.join(cache_dir, 'trends'), os.path.abspath(args.replays_dir), args.matchup, min_duration)
+                   for trend in trends]
+    if args.use_cache:
+        states = [TrendState.load(path, args.number_of_replays, args.recent_trend) for path in state_paths]
+    else:
+        states = [TrendState(args.number_of_replays, args.recent_trend) for _ in trends]
 
-        except StopIteration:
-            break # ran out of replays, that's fine
+    with profiling.phase('update_trends'):
+        added = engine.update(states, replays, args.number_of_replays, args.jobs)
+    print(f"{added} new replays, peak memory {profiling.peak_rss_mb():.0f} MB")
 
+    if args.use_cache:
+        for state, path in zip(states, state_paths):
+            state.save(path)
+        cache.evict()
+        event_cache.evict()
 
+    processed = max(len(state.overall.points) for state in states)
     if processed > 1:
-        fig, axeses = plt.subplots(len(trends), 1)
-        for i, trend in enumerate(trends):
-            # we processed the range of replays in reverse chronological order (newest to oldest) - plot them
-            # in reverse of that (oldest to newest)
-            trend.plot(axeses[i], reverse=True)
+        import matplotlib.pyplot as plt
+        with profiling.phase('plot'):
+            # a row per metric, a column per cutoff
+            fig, axeses = plt.subplots(len(trend_classes), len(cutoffs), squeeze=False)
+            for i, (trend, state) in enumerate(zip(trends, states)):
+                axes = axeses[i // len(cutoffs), i % len(cutoffs)]
+                axes.set_title(f"{type(trend).__name__} until {timestamp(real_seconds(trend.cutoff))}")
+                if len(state.overall.points) > 1:
+                    trend.plot(axes, state)
+        if args.profile is not None:
+            with profiling.phase('draw'):
+                fig.canvas.draw()
+            profiling.write_from_args(args)
 
         plt.show()
     else:
         print(f"At least two usable replays are required to plot trends, found: {processed}")
+        profiling.write_from_args(args)
 
 
@@ -1,23 +1,24 @@
 import argparse
+import io
 import itertools
 import os.path
 import sys
-import time
 
-import matplotlib.pyplot as plt
-import sc2reader
-from matplotlib.figure import Figure
-from sc2reader.events import PlayerLeaveEvent
-
-from .replay_helpers import replays_dir, discover_players, find_last_replay, game_seconds, real_seconds, parse_timestamp
+from . import profiling
+from .event_dispatch import EventDispatcher
+from .replay_context import ReplayContext
+from .replay_helpers import replays_dir, cache_dir, file_hash, ReplaySession, replay_session, discover_players, find_last_replay, parse_timestamp
 from .SC2SkillTrackerException import SC2SkillTrackerException
-from .trackers.DroneTracker import DroneTracker
-from .trackers.InjectTracker import InjectTracker
-from .trackers.LarvaeVsResourcesTracker import LarvaeVsResourcesTracker
-from .trackers.UpgradeTracker import UpgradeTracker
+from .trackers import LazyTrackers
+
+# matplotlib, sc2reader and the trackers (which import sc2reader) are imported where they're needed - importing them
+# takes longer than many commands need to run, e.g. showing --help
 
 
-def plot_trackers(player_name, trackers, subsidiary_trackers, cutoff_time, figure, axeses):
+def plot_trackers(player_name, trackers, subsidiary_trackers, timeline, figure, axeses, bands=None):
+    """ :param timeline: Timeline (until the cutoff) that all trackers are plotted on, so that their x-axes align
+        :param bands: CorpusBands of the player's matchup to plot trackers against, if any
+    """
     # plotting every tracker in a separate Axes of the same Figure, except subsidiary trackers,
     # which share plots with other trackers
     figure.suptitle(player_name, fontsize=16)
@@ -26,81 +27,191 @@ def plot_trackers(player_name, trackers, subsidiary_trackers, cutoff_time, figur
     for i, tracker in enumerate(trackers):
         axes = axeses[i]
         axes.set_title(tracker.title)
-        tracker.plot(axes, cutoff_time)
+        with profiling.phase(f'plot/{type(tracker).__name__}'):
+            tracker.plot(axes, timeline, bands)
 
         for sub_tracker in subsidiary_trackers:
             if sub_tracker.can_share_plot_with(tracker):
-                sub_tracker.plot(axes, cutoff_time)
+                with profiling.phase(f'plot/{type(sub_tracker).__name__}'):
+                    sub_tracker.plot(axes, timeline)
+
+        # after plotting, which may autoscale the axes
+        timeline.format_axes(axes)
 
 
-def consume_replay(replay_file, trackers, requested_cutoff=None):
+def consume_replay(replay, trackers, requested_cutoff=None):
     """ Returns the lesser of requested_cutoff and game end (replay end or a player leaving, presumably always the
         latter even if all buildings are destroyed?)
+        :param replay: replay file or ReplaySession
     """
-    rep = sc2reader.load_replay(replay_file)
-    true_cutoff = None
-    for event in rep.events:
+    true_cutoffs = []
+    consume_replay_checkpoints(replay, trackers, [requested_cutoff], lambda _, true_cutoff: true_cutoffs.append(true_cutoff))
+    return true_cutoffs[0]
+
+
+def consume_replay_checkpoints(replay, trackers, cutoffs, checkpoint):
+    """ Consumes the replay until the last of the cutoffs in one pass, calling checkpoint(cutoff, true_cutoff) as
+        each one is reached - trackers have consumed events until then (and no further), so that's the time to take
+        their measurements. true_cutoff is the lesser of cutoff and game end, see consume_replay().
+        :param cutoffs: in game seconds, None for game end
+    """
+    session = replay_session(replay)
+    dispatcher = EventDispatcher(trackers)
+
+    # player names are resolved to IDs once per replay, for all trackers
+    context = ReplayContext(session.load().players)
+    for tracker in trackers:
+        tracker.resolve(context)
+
+    with profiling.phase('consume_events', session.replay_file):
+        # game end (None) last
+        _consume_events(session, dispatcher, sorted(cutoffs, key=lambda cutoff: (cutoff is None, cutoff or 0)), checkpoint)
+
+
+def _consume_events(session, dispatcher, cutoffs, checkpoint):
+    from sc2reader.events import PlayerLeaveEvent
+
+    def lesser(cutoff, end):
+        return min(end, cutoff) if cutoff is not None else end
+
+    pending = list(cutoffs)
+    # events after the last cutoff's second aren't needed - game end beyond it doesn't change any true cutoff
+    until = (int(pending[-1]) + 1) * 16 if pending and pending[-1] is not None else None
+    for event in session.events(until):
         if isinstance(event, PlayerLeaveEvent):
             # we consider the game to be over as soon as either player leaves
-            true_cutoff = min(event.second, requested_cutoff) if requested_cutoff is not None else event.second
-            break
-        elif requested_cutoff is None or event.second <= requested_cutoff:
-            for tracker in trackers:
-                tracker.consume_event(event)
-            true_cutoff = event.second # track last event seen
-        else:
-            break
+            for cutoff in pending:
+                checkpoint(cutoff, lesser(cutoff, event.second))
+            return
+
+        while pending and pending[0] is not None and event.second > pending[0]:
+            # the game went on past the cutoff
+            checkpoint(pending[0], pending[0])
+            pending.pop(0)
+
+        if not pending:
+            # past the last cutoff - stop reading events
+            return
 
-    assert(true_cutoff is not None)
-    return true_cutoff
+        dispatcher.dispatch(event)
 
+    # ran out of events without anyone leaving - the game ended with the replay
+    for cutoff in pending:
+        checkpoint(cutoff, lesser(cutoff, session.length))
 
-def generate_plots(replay_file, requested_cutoff=None, use_pyplot=False):
+
+# trackers with a plot of their own, by name
+PLOT_TRACKERS = LazyTrackers(['LarvaeVsResourcesTracker', 'DroneTracker', 'InjectTracker'])
+
+
+def load_bands(session, player_name, bands_player):
+    """ Returns CorpusBands of bands_player's games in the player's matchup in this replay, None if the player isn't
+        bands_player (see ReplayContext.player_ids()), the replay isn't a 1v1 or there are no bands (yet)
+    """
+    players = discover_players(session)
+    if bands_player is None or not player_name.startswith(bands_player) or len(players) != 2:
+        return None
+
+    from .corpus_bands import CorpusBands, bands_path
+    player, opponent = sorted(players, key=lambda player: player.name != player_name)
+    bands = CorpusBands.load(bands_path(bands_player, f'{player.play_race[0]}v{opponent.play_race[0]}'))
+    return bands if bands.replays else None
+
+
+def generate_plots(replay_file, requested_cutoff=None, use_pyplot=False, tracker_names=None, bands_player=None,
+                   event_cache=None, riders=None):
     """ Returns a list of matplotlib Figures, one per player, with trackers plotted thereon
         :param requested_cutoff: - plot at most until this time in game seconds
+        :param tracker_names: - names of trackers to plot (keys of PLOT_TRACKERS), all of them if None
+        :param bands_player: - plot this player (if in the replay) against percentile bands of their games in the
+                               matchup, see corpus_bands
+        :param event_cache: - EventCache to take the replay's events from (and to add them to)
+        :param riders: - (trackers, cutoffs, checkpoint) to consume in the same pass over the events, see
+                         consume_replay_checkpoints() - e.g. to measure trends of the replay as it's rendered. The
+                         cutoffs can't be past requested_cutoff, the plotted trackers would consume events past it.
     """
-    zerg_names = [player.name for player in discover_players(replay_file) if player.play_race == "Zerg"]
+    # players come from replay details, so this doesn't decode any events - the pass over the events does that, once
+    session = ReplaySession(replay_file, event_cache)
+    zerg_names = [player.name for player in discover_players(session) if player.play_race == "Zerg"]
 
     if len(zerg_names) == 0:
         raise SC2SkillTrackerException("No Zerg players found")
 
-    all_trackers = [LarvaeVsResourcesTracker, DroneTracker, InjectTracker]
+    if tracker_names is None:
+        all_trackers = list(PLOT_TRACKERS.values())
+    else:
+        unknown = [name for name in tracker_names if name not in PLOT_TRACKERS]
+        if unknown or not tracker_names:
+            raise SC2SkillTrackerException(f"Unknown trackers: {', '.join(unknown)} (available: {', '.join(PLOT_TRACKERS)})")
+        all_trackers = [PLOT_TRACKERS[name] for name in tracker_names]
 
     # instantiate and associate all trackers for each player
     player_trackers = { player_name:[tracker(player_name) for tracker in all_trackers] for player_name in zerg_names }
     # subsidiary trackers expose can_share_plot_with() method which tell us which other trackers they're happy to share
     # axes with (e.g. upgrades can be plotted on any timeline, they don't need their dedicated plot)
+    from .trackers.UpgradeTracker import UpgradeTracker
     subsidiary_trackers = { player_name:[UpgradeTracker(player_name)] for player_name in zerg_names }
 
-    # TODO check that this actually lines up with player stat events
-    clamped_cutoff = requested_cutoff // 10 * 10 if requested_cutoff is not None else requested_cutoff #TODO check corner cases, e.g. clamping to zero
-    # provide a flat list of all trackers to consume_replay()
-    true_cutoff = consume_replay(replay_file, list(itertools.chain(*player_trackers.values())) + list(itertools.chain(*subsidiary_trackers.values())), clamped_cutoff)
+    rider_trackers, rider_cutoffs, rider_checkpoint = riders if riders is not None else ([], [], None)
+    assert(requested_cutoff is None or all(cutoff is not None and cutoff <= requested_cutoff for cutoff in rider_cutoffs))
+    true_cutoffs = {}
+    def checkpoint(cutoff, true_cutoff):
+        if cutoff in rider_cutoffs:
+            rider_checkpoint(cutoff, true_cutoff)
+        true_cutoffs[cutoff] = true_cutoff
+
+    # provide a flat list of all trackers to consume_replay_checkpoints()
+    consume_replay_checkpoints(session, list(itertools.chain(*player_trackers.values())) + list(itertools.chain(*subsidiary_trackers.values())) + list(rider_trackers),
+                               set(rider_cutoffs) | {requested_cutoff}, checkpoint)
+    true_cutoff = true_cutoffs[requested_cutoff]
+
+    from .timeline import Timeline
+    timeline = Timeline(true_cutoff)
 
     figures = []
     for player in player_trackers:
         # this split is awkward, but I couldn't find a way to create a figure without pyplot and then display it with it
         # (which would allow to just return the figure and let the caller decide how to display it)
         if use_pyplot:
-            fig, axeses = plt.subplots(len(player_trackers[player]), 1)
+            import matplotlib.pyplot as plt
+            fig, axeses = plt.subplots(len(player_trackers[player]), 1, squeeze=False)
         else:
             # Generate the figure without using pyplot (useful for embedding graphs, e.g. on the web)
+            from matplotlib.figure import Figure
             fig = Figure(figsize=(18, 12))
-            axeses = fig.subplots(len(player_trackers[player]), 1)
+            axeses = fig.subplots(len(player_trackers[player]), 1, squeeze=False)
 
-        plot_trackers(player, player_trackers[player], subsidiary_trackers[player], true_cutoff, fig, axeses)
+        plot_trackers(player, player_trackers[player], subsidiary_trackers[player], timeline, fig, axeses[:, 0],
+                      load_bands(session, player, bands_player))
         figures.append(fig)
 
     return figures
 
 
+def render_figures(replay_file, requested_cutoff=None, fmt='png', tracker_names=None):
+    """ Returns generate_plots() figures rendered in the given format (e.g. png, svg) as bytes, one per player.
+        Doesn't use pyplot, so it works headless and in worker processes.
+    """
+    rendered = []
+    for figure in generate_plots(replay_file, requested_cutoff, use_pyplot=False, tracker_names=tracker_names):
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format=fmt)
+        rendered.append(buffer.getvalue())
+
+    return rendered
+
+
 def run():
     parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
     # both optional
     parser.add_argument('-u', '--until', type=parse_timestamp, dest='cutoff', action='store', help='cutoff time in format mm:ss')
     parser.add_argument('-b', '--build-order', type=str, dest='build_order', action='store', help='path to build order json file')
+    parser.add_argument('-B', '--bands', type=str, dest='bands_player', action='store', help='plot this player against percentile bands of their past games in the matchup (build them with corpus_bands)')
+    parser.add_argument('-s', '--stored', dest='stored', action='store_true', help='show figures pre-rendered by the watch daemon, if there are any (instead of parsing the replay)')
+    profiling.add_arguments(parser)
     parser.add_argument("replay_file", nargs='?', help='Name of the replay file (absolute path or relative to replay search path). Latest replay if omitted.')
     args = parser.parse_args()
+    profiling.enable_from_args(args)
 
     if args.replay_file is None:
         if replays_dir:
@@ -119,8 +230,27 @@ def run():
         print("Replay file not found")
         sys.exit(1)
 
+    import matplotlib.pyplot as plt
+
+    if args.stored:
+        from .figure_store import FigureStore # imports this module
+        stored = FigureStore(os.path.join(cache_dir, 'figures')).get(file_hash(replay_file), args.cutoff)
+        if stored is not None:
+            for path in stored:
+                fig = plt.figure(figsize=(18, 12))
+                fig.figimage(plt.imread(path))
+            plt.show()
+            return
+        print("No stored figures for this replay, rendering them")
+
     try:
-        generate_plots(replay_file, args.cutoff, use_pyplot=True)
+        figures = generate_plots(replay_file, args.cutoff, use_pyplot=True, bands_player=args.bands_player)
+        if args.profile is not None:
+            # plt.show() would draw them anyway, but then we couldn't time it
+            with profiling.phase('draw', replay_file):
+                for figure in figures:
+                    figure.canvas.draw()
+            profiling.write_from_args(args)
         plt.show()
     except SC2SkillTrackerException as e:
         print("Error: " + str(e))
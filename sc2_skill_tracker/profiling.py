@@ -0,0 +1,140 @@
+"""
+Optional per-phase timing (wall and CPU time), broken down per replay and per tracker, with a JSON report (which
+also has the peak memory use).
+
+Code marks its phases with `with profiling.phase('name', replay):` - which costs next to nothing unless profiling
+was enabled with enable() (e.g. by the --profile option of plotter, plot_trends and cleanup_replays_dir). Phases can be
+nested, e.g. 'consume_events' includes the time of trackers' consume_event calls.
+
+Only the calling process is profiled, so run with a single job (-j 1) to see per-replay phases of parallel commands.
+"""
+
+import contextlib
+import cProfile
+import json
+import sys
+import time
+
+from collections import defaultdict
+
+try:
+    import resource
+except ImportError: # not on Windows
+    resource = None
+
+
+def _timings():
+    return {'wall': 0.0, 'cpu': 0.0, 'calls': 0}
+
+
+class Profiler(object):
+    def __init__(self, hot_phase=None):
+        """ :param hot_phase: name of a phase to also run under cProfile """
+        self.phases = defaultdict(_timings)
+        self.replays = defaultdict(lambda: defaultdict(_timings))
+        self.trackers = defaultdict(lambda: dict(_timings(), events=0))
+        self.hot_phase = hot_phase
+        self.cprofile = cProfile.Profile() if hot_phase is not None else None
+        self._hot_depth = 0
+
+
+    @contextlib.contextmanager
+    def phase(self, name, replay=None):
+        hot = name == self.hot_phase
+        if hot:
+            # nested calls of the hot phase mustn't enable the profiler twice
+            if self._hot_depth == 0:
+                self.cprofile.enable()
+            self._hot_depth += 1
+
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            if hot:
+                self._hot_depth -= 1
+                if self._hot_depth == 0:
+                    self.cprofile.disable()
+
+            timings = [self.phases[name]] + ([self.replays[replay][name]] if replay is not None else [])
+            for t in timings:
+                t['wall'] += wall
+                t['cpu'] += cpu
+                t['calls'] += 1
+
+
+    def tracker_callback(self, tracker, consume_event):
+        """ Returns consume_event wrapped to count and time the events the tracker gets """
+        timings = self.trackers[f'{type(tracker).__name__}({tracker.player_name})']
+        def timed_consume_event(event):
+            wall, cpu = time.perf_counter(), time.process_time()
+            consume_event(event)
+            timings['wall'] += time.perf_counter() - wall
+            timings['cpu'] += time.process_time() - cpu
+            timings['events'] += 1
+
+        return timed_consume_event
+
+
+    def report(self):
+        return {'phases': self.phases, 'replays': self.replays, 'trackers': self.trackers, 'peak_rss_mb': peak_rss_mb()}
+
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(path + '.prof')
+
+
+class NullProfiler(object):
+    """ Does nothing, as cheaply as possible """
+    def phase(self, name, replay=None):
+        return contextlib.nullcontext()
+
+    def tracker_callback(self, tracker, consume_event):
+        return consume_event
+
+
+profiler = NullProfiler()
+
+
+def peak_rss_mb():
+    """ Peak resident memory in MB of this process or any of its (finished) worker processes, whichever is the
+        largest - NaN where it can't be measured
+    """
+    if resource is None:
+        return float('nan')
+
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def enable(hot_phase=None):
+    global profiler
+    profiler = Profiler(hot_phase)
+    return profiler
+
+
+def phase(name, replay=None):
+    return profiler.phase(name, replay)
+
+
+def add_arguments(parser):
+    """ Adds the --profile options to an argparse parser """
+    parser.add_argument('--profile', type=str, dest='profile', action='store', help='write per-phase, per-replay and per-tracker timings as JSON to this file (use with -j 1)')
+    parser.add_argument('--profile-hot', type=str, dest='profile_hot', action='store', help="also run this phase (e.g. consume_events) under cProfile, dumped to the --profile file + '.prof'")
+
+
+def enable_from_args(args):
+    if args.profile is not None:
+        enable(args.profile_hot)
+
+
+def write_from_args(args):
+    if args.profile is not None:
+        profiler.write(args.profile)
+        print(f"profile written to {args.profile}")
@@ -0,0 +1,66 @@
+"""
+Per-replay lookups shared by all trackers: player names are resolved to player IDs once (and then used to route
+events, see EventDispatcher) and unit type names are interned into integer codes, so that trackers filter events with
+integer comparisons instead of string matching.
+"""
+
+from .replay_helpers import Entity
+
+
+class UnitType(object):
+    """ Integer codes of unit types the trackers care about """
+    OTHER = 0
+    LARVA = 1
+    EGG = 2
+    DRONE = 3
+    HATCHERY = 4
+    LAIR = 5
+    HIVE = 6
+    QUEEN = 7
+
+
+TOWN_HALLS = frozenset((UnitType.HATCHERY, UnitType.LAIR, UnitType.HIVE))
+
+# larvae and eggs are matched by prefix, like the string comparisons the codes replace
+_PREFIX_CODES = ((Entity.LARVA, UnitType.LARVA), (Entity.EGG, UnitType.EGG))
+_EXACT_CODES = {Entity.DRONE: UnitType.DRONE, 'Hatchery': UnitType.HATCHERY, 'Lair': UnitType.LAIR,
+                'Hive': UnitType.HIVE, 'Queen': UnitType.QUEEN}
+
+_interned = {}
+
+
+def unit_type_code(name):
+    """ Returns the integer code of a unit type name (UnitType.OTHER for types nobody tracks) - string matching only
+        happens the first time a name is seen
+    """
+    try:
+        return _interned[name]
+    except KeyError:
+        code = _EXACT_CODES.get(name, UnitType.OTHER)
+        for prefix, prefix_code in _PREFIX_CODES:
+            if str(name).startswith(prefix):
+                code = prefix_code
+        _interned[name] = code
+        return code
+
+
+class ReplayContext(object):
+    def __init__(self, players):
+        self.players = players
+        self._unit_codes = {}
+
+
+    def player_ids(self, player_name):
+        """ Returns IDs of players whose names start with player_name (normally just the one) """
+        return {player.pid for player in self.players if player.name.startswith(player_name)}
+
+
+    def unit_code(self, unit):
+        """ Returns the unit's type code. A unit's name is the type it had when the replay finished loading (events
+            of a Hive show a Hive from the moment it was placed as a Hatchery), so it's resolved once per unit.
+        """
+        try:
+            return self._unit_codes[unit.id]
+        except KeyError:
+            code = self._unit_codes[unit.id] = unit_type_code(unit.name)
+            return code
@@ -1,16 +1,28 @@
+import argparse
+import hashlib
+import heapq
+import itertools
 import os
-import sc2reader
 
 from stat import S_ISREG, ST_CTIME, ST_MODE
 
-from sc2reader.events import PlayerStatsEvent
+from . import profiling
 
 REPLAY_PATH_VAR = 'SC2_SKILL_TRACKER_REPLAY_PATH'
 
 replays_dir = os.path.normpath(os.environ[REPLAY_PATH_VAR]) if REPLAY_PATH_VAR in os.environ else None
 
+CACHE_PATH_VAR = 'SC2_SKILL_TRACKER_CACHE_PATH'
+
+cache_dir = os.path.normpath(os.environ[CACHE_PATH_VAR]) if CACHE_PATH_VAR in os.environ \
+            else os.path.join(os.path.expanduser('~'), '.cache', 'sc2_skill_tracker')
+
 GAME_SPEED = 1.4
 
+coop_maps = ["Void Thrashing", "Void Launch", "Oblivion Express", "Rifts to Korhal", "Temple of the Past",
+             "Lock & Load", "Chain of Ascension", "The Vermillion Problem", "Mist Opportunities", "Miner Evacuation",
+             "Dead of Night", "Scythe of Amon", "Part and Parcel", "Malwarfare", "Cradle of Death"]
+
 
 def real_seconds(game_seconds):
     """ converts from game seconds (faster speed) to wall clock seconds """
@@ -36,15 +48,120 @@ def parse_timestamp(arg):
     return game_seconds(int(split[0]) * 60 + int(split[1]))
 
 
-def discover_players(replay_file):
-    rep = sc2reader.load_replay(replay_file)
-    rep.load_tracker_events()
-    players = set()
-    for event in rep.tracker_events:
-        if isinstance(event, PlayerStatsEvent):
-            players.add(event.player)
+class ReplaySession(object):
+    """ A replay file shared by everything that needs to look at it, so that it's loaded at most once for every
+        level of detail asked for (and not at all for levels below one that's already loaded)
+    """
+    # sc2reader load levels: players come from replay.details and attributes
+    DETAILS_LOAD_LEVEL = 2
+    FULL_LOAD_LEVEL = 4 # tracker and game events
+
+    def __init__(self, replay_file, event_cache=None):
+        """ :param event_cache: EventCache to take players and events from, instead of decoding the replay (which
+                                only happens once, to fill the cache)
+        """
+        self.replay_file = replay_file
+        self.event_cache = event_cache
+        self._replay = None
+        self._load_level = None
+        self._cached_replay = None
+
+
+    def _cached(self):
+        if self._cached_replay is None:
+            with profiling.phase('load_replay/event_cache', self.replay_file):
+                self._cached_replay = self.event_cache.load(self.replay_file)
+        return self._cached_replay
+
+
+    def _load(self, load_level):
+        if self._replay is None or self._load_level < load_level:
+            with profiling.phase(f'load_replay/level_{load_level}', self.replay_file):
+                import sc2reader # slow to import, only when a replay is actually loaded
+                self._replay = sc2reader.load_replay(self.replay_file, load_level=load_level)
+            self._load_level = load_level
+        return self._replay
+
+
+    def close(self):
+        """ Drops the loaded replay (and cached events), so that they can be freed while the session is still
+            referenced - it's loaded again if needed
+        """
+        self._replay = None
+        self._load_level = None
+        self._cached_replay = None
+
+
+    @property
+    def details(self):
+        """ Replay loaded without any events - enough for players, races, map name, length etc. """
+        return self._load(ReplaySession.DETAILS_LOAD_LEVEL)
+
+
+    @property
+    def replay(self):
+        """ Fully loaded replay, including game and tracker events """
+        return self._load(ReplaySession.FULL_LOAD_LEVEL)
+
+
+    @property
+    def players(self):
+        """ Players (not observers), including AIs """
+        if self.event_cache is not None:
+            return list(self._cached().players)
+        return list(self.details.players)
+
+
+    @property
+    def length(self):
+        """ Length of the replay in game seconds (from the header) """
+        frames = self._cached().frames if self.event_cache is not None else self.details.frames
+        return frames >> 4 # same as sc2reader's event.second
+
+
+    def load(self):
+        """ Returns the fully loaded replay (or its CachedReplay) """
+        if self.event_cache is not None:
+            return self._cached()
+        return self.replay
+
+
+    def events(self, until=None):
+        """ Yields tracker and game events lazily, in time order. sc2reader can only decode whole event files, so
+            the whole replay is decoded regardless - the saving comes from the event cache, which only reads events
+            until the frame asked for. Stop iterating as soon as you're done.
+            :param until: only events before this frame, None for all of them - cached events beyond it aren't read
+        """
+        if self.event_cache is not None:
+            yield from self._cached().events(until)
+            return
+
+        rep = self.load()
+        # both lists are in time order already; tracker events go first on ties, like in sc2reader's replay.events
+        events = heapq.merge(rep.tracker_events, rep.game_events, key=lambda event: event.frame)
+        yield from itertools.takewhile(lambda event: until is None or event.frame < until, events)
+
+
+def replay_session(replay):
+    """ Accepts either a replay file or a ReplaySession """
+    return replay if isinstance(replay, ReplaySession) else ReplaySession(replay)
+
+
+def discover_players(replay):
+    """ :param replay: replay file or ReplaySession """
+    session = replay_session(replay)
+    with profiling.phase('discover_players', session.replay_file):
+        return session.players
+
+
+def file_hash(path):
+    """ Returns a hex digest of the file's contents - replays are identified by content, not by name """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            digest.update(chunk)
 
-    return players
+    return digest.hexdigest()
 
 
 def find_last_replay(base_dir):
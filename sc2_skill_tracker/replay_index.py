@@ -0,0 +1,212 @@
+"""
+SQLite index of the replays directory - players, races, map, duration etc. of every replay, so that questions like
+"last 50 ZvT games as orastem over 7 minutes" can be answered without opening any replays.
+
+The index is brought up to date by update(), which only (re)reads replays that are new or whose modification time
+or size changed since they were indexed.
+"""
+
+import argparse
+import os
+import sqlite3
+
+from .parallel import ordered_map
+from .replay_helpers import replays_dir, cache_dir, coop_maps, parse_timestamp, file_hash, ReplaySession
+from .SC2SkillTrackerException import SC2SkillTrackerException
+
+# sc2reader's 'second' is frame // 16, i.e. game seconds like everywhere else
+FRAMES_PER_SECOND = 16
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replays (
+    path TEXT PRIMARY KEY,
+    directory TEXT, -- the index can hold more than one replays directory, queries only look at one
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL,
+    ctime REAL NOT NULL,
+    map_name TEXT,
+    duration REAL, -- game seconds
+    is_1v1_vs_human INTEGER NOT NULL DEFAULT 0,
+    hash TEXT, -- file_hash() of the replay, so that users of the index needn't read every replay to identify it
+    error TEXT -- unreadable replays are indexed too, so that they're not re-read until they change
+);
+CREATE TABLE IF NOT EXISTS players (
+    path TEXT NOT NULL REFERENCES replays(path) ON DELETE CASCADE,
+    pid INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    race TEXT,
+    is_human INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS players_by_path ON players(path);
+CREATE INDEX IF NOT EXISTS replays_by_ctime ON replays(ctime);
+CREATE INDEX IF NOT EXISTS replays_by_directory ON replays(directory, ctime);
+"""
+
+DEFAULT_INDEX_PATH = os.path.join(cache_dir, 'replay_index.sqlite3')
+
+
+def read_metadata(path):
+    """ Returns replay metadata as a dict of plain values, which are cheap to send back from worker processes """
+    replay_hash = file_hash(path)
+    try:
+        details = ReplaySession(path).details
+    except Exception as e: # sc2reader can fail in many ways on broken or unsupported replays - index the error
+        return {'error': f'{type(e).__name__}: {e}', 'map_name': None, 'duration': None, 'players': [],
+                'is_1v1_vs_human': False, 'hash': replay_hash}
+
+    players = [{'pid': player.pid, 'name': player.name, 'race': player.play_race, 'is_human': player.is_human}
+               for player in details.players]
+
+    return {'error': None,
+            'hash': replay_hash,
+            'map_name': details.map_name,
+            'duration': details.frames / FRAMES_PER_SECOND,
+            'players': players,
+            'is_1v1_vs_human': len(players) == 2 and all(player['is_human'] for player in players)
+                               and details.map_name not in coop_maps}
+
+
+class ReplayIndex(object):
+    def __init__(self, db_path=DEFAULT_INDEX_PATH):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.executescript(SCHEMA)
+
+
+    def update(self, directory, jobs=1):
+        """ Indexes new and modified replays in the directory and forgets ones that no longer exist.
+            Returns paths of (re)indexed replays.
+        """
+        directory = os.path.abspath(directory)
+        known = {path: (mtime, size) for path, mtime, size in self.connection.execute("SELECT path, mtime, size FROM replays WHERE directory = ?",
+                                                                                      (directory,))}
+
+        changed = []
+        present = set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                path = os.path.abspath(entry.path)
+                stat = entry.stat()
+                present.add(path)
+                if known.get(path) != (stat.st_mtime, stat.st_size):
+                    changed.append((path, stat))
+
+        with self.connection:
+            for path in known.keys() - present:
+                self.connection.execute("DELETE FROM replays WHERE path = ?", (path,))
+
+        # only the changed replays are opened, potentially in parallel - each one is stored as soon as it's read, so
+        # that the database isn't locked for the whole update
+        for (path, stat), metadata in zip(changed, ordered_map(read_metadata, [path for path, _ in changed], jobs)):
+            self.add(path, stat, metadata)
+
+        return [path for path, _ in changed]
+
+
+    def add(self, path, stat, metadata):
+        """ Stores (or replaces) a replay's metadata
+            :param stat: os.stat() of the replay, as its metadata was read
+            :param metadata: see read_metadata()
+        """
+        path = os.path.abspath(path)
+        with self.connection:
+            self.connection.execute("DELETE FROM replays WHERE path = ?", (path,))
+            self.connection.execute("INSERT INTO replays (path, directory, mtime, size, ctime, map_name, duration, is_1v1_vs_human, hash, error)"
+                                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                    (path, os.path.dirname(path), stat.st_mtime, stat.st_size, stat.st_ctime, metadata['map_name'],
+                                     metadata['duration'], metadata['is_1v1_vs_human'], metadata['hash'], metadata['error']))
+            self.connection.executemany("INSERT INTO players (path, pid, name, race, is_human) VALUES (?, ?, ?, ?, ?)",
+                                        [(path, player['pid'], player['name'], player['race'], player['is_human'])
+                                         for player in metadata['players']])
+
+
+    def is_current(self, path, stat):
+        """ Returns whether the replay is indexed as it is now, i.e. hasn't changed since
+            :param stat: os.stat() of the replay
+        """
+        row = self.connection.execute("SELECT mtime, size FROM replays WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return row is not None and row == (stat.st_mtime, stat.st_size)
+
+
+    def remove(self, path):
+        with self.connection:
+            self.connection.execute("DELETE FROM replays WHERE path = ?", (os.path.abspath(path),))
+
+
+    def error(self, path):
+        """ Returns why the replay couldn't be read, None if it could (or isn't indexed) """
+        row = self.connection.execute("SELECT error FROM replays WHERE path = ?", (os.path.abspath(path),)).fetchone()
+        return None if row is None else row[0]
+
+
+    def players(self, path):
+        return self.connection.execute("SELECT pid, name, race, is_human FROM players WHERE path = ? ORDER BY pid",
+                                       (os.path.abspath(path),)).fetchall()
+
+
+    def hashes(self):
+        """ Returns {path: file_hash()} of all indexed replays, as of their last update() """
+        return dict(self.connection.execute("SELECT path, hash FROM replays"))
+
+
+    def recent(self, directory, limit=None):
+        """ Returns (path, map_name, error) of all replays indexed in the directory, newest first """
+        return self.connection.execute("SELECT path, map_name, error FROM replays WHERE directory = ? ORDER BY ctime DESC LIMIT ?",
+                                       (os.path.abspath(directory), -1 if limit is None else limit)).fetchall()
+
+
+    def query(self, directory, player=None, matchup=None, min_duration=None, limit=None):
+        """ Returns paths of matching replays in the directory, newest first
+            :param player: only games with a player whose name starts with this
+            :param matchup: e.g. 'ZvT' - player's race first, only 1v1 games vs humans (requires player)
+            :param min_duration: in game seconds
+        """
+        sql = "SELECT DISTINCT r.path, r.ctime FROM replays r"
+        conditions = ["r.error IS NULL"]
+        params = []
+
+        if player is not None:
+            sql += " JOIN players me ON me.path = r.path AND substr(me.name, 1, length(?)) = ?"
+            params += [player, player]
+
+        if matchup is not None:
+            if player is None:
+                raise SC2SkillTrackerException("Matchup filter requires a player")
+            races = matchup.upper().split('V')
+            if len(races) != 2:
+                raise SC2SkillTrackerException(f"Invalid matchup: {matchup}")
+            sql += " JOIN players them ON them.path = r.path AND them.pid != me.pid"
+            conditions += ["r.is_1v1_vs_human", "substr(me.race, 1, 1) = ?", "substr(them.race, 1, 1) = ?"]
+            params += races
+
+        if min_duration is not None:
+            conditions.append("r.duration >= ?")
+            params.append(min_duration)
+
+        conditions.append("r.directory = ?")
+        params.append(os.path.abspath(directory))
+
+        sql += " WHERE " + " AND ".join(conditions) + " ORDER BY r.ctime DESC LIMIT ?"
+        params.append(-1 if limit is None else limit)
+
+        return [path for path, _ in self.connection.execute(sql, params)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f'Updates the replay index and lists matching replays, newest first. Default replay search path: {replays_dir}')
+    parser.add_argument('-n', '--number-of-replays', type=int, dest='number_of_replays', action='store', help='list at most this many replays')
+    parser.add_argument('-p', '--player', type=str, dest='player', action='store', help='only games with this player')
+    parser.add_argument('-m', '--matchup', type=str, dest='matchup', action='store', help="e.g. ZvT (player's race first)")
+    parser.add_argument('--min-duration', type=parse_timestamp, dest='min_duration', action='store', help='only games at least this long, in format mm:ss')
+    parser.add_argument('-d', '--replays-dir', type=str, default=replays_dir, dest='replays_dir', action='store', help='replay search path')
+    parser.add_argument('-j', '--jobs', type=int, default=1, dest='jobs', action='store', help='number of worker processes reading new replays in parallel')
+
+    args = parser.parse_args()
+
+    index = ReplayIndex()
+    index.update(args.replays_dir, args.jobs)
+    for path in index.query(args.replays_dir, args.player, args.matchup, args.min_duration, args.number_of_replays):
+        print(path)
@@ -0,0 +1,58 @@
+"""
+On-disk cache of per-replay results (e.g. trend data points), so that replays which never change are only parsed once.
+
+Every entry is a small JSON file named after the hash of its key. Reading an entry refreshes its modification time,
+which is what evict() uses to drop the least recently used entries once the cache grows past its size limit.
+"""
+
+import hashlib
+import json
+import os
+
+from .file_helpers import atomic_write, evict_lru
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024 # bytes
+
+
+class ResultCache(object):
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+
+    @staticmethod
+    def key(*parts):
+        """ Builds a cache key out of anything JSON-serialisable, e.g. (replay hash, cutoff, player, version) """
+        return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+    def _path(self, key):
+        # fan out into subdirectories so that no single directory gets thousands of entries
+        return os.path.join(self.directory, key[:2], key + '.json')
+
+
+    def __getitem__(self, key):
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            # a missing or half-written entry is a cache miss
+            raise KeyError(key)
+
+        os.utime(path) # mark as recently used
+        return entry['value']
+
+
+    def __setitem__(self, key, value):
+        with atomic_write(self._path(key)) as f:
+            json.dump({'value': value}, f)
+
+
+    def __contains__(self, key):
+        return os.path.isfile(self._path(key))
+
+
+    def evict(self):
+        """ Deletes least recently used entries until the cache fits in max_size """
+        evict_lru(self.directory, self.max_size)
@@ -0,0 +1,202 @@
+"""
+Local HTTP server for replay plots, e.g. to browse replays together with teammates:
+
+    /                                   recent replays
+    /plot?replay=<name or path>         plot of the first Zerg player (replays directory only), optional parameters:
+        cutoff=mm:ss                    plot until then
+        format=png|svg
+        player=<n>                      n-th Zerg player (from 0)
+        trackers=<name>,<name>          trackers to plot (see plotter.PLOT_TRACKERS), all by default
+
+Figures are rendered by a pool of worker processes and kept in an LRU cache keyed by replay content hash, cutoff,
+tracker set and format, so a replay is only parsed once however many times it's looked at.
+
+The replay index is brought up to date once before serving and then periodically by a background thread, requests
+only query it.
+"""
+
+import argparse
+import html
+import os
+import sys
+import threading
+import traceback
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, quote
+
+from .plotter import PLOT_TRACKERS, render_figures
+from .replay_helpers import REPLAY_PATH_VAR, replays_dir, file_hash, parse_timestamp
+from .replay_index import ReplayIndex
+from .SC2SkillTrackerException import SC2SkillTrackerException
+
+CONTENT_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024 # bytes
+DEFAULT_INDEX_INTERVAL = 30 # seconds
+
+
+class RenderCache(object):
+    """ Thread-safe LRU cache of rendered figures (lists of bytes), bounded by total size. Renders of the same key
+        requested concurrently are only done once.
+    """
+    def __init__(self, executor, max_size=DEFAULT_CACHE_SIZE):
+        self.executor = executor
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict() # key -> rendered figures
+        self.in_flight = {} # key -> Future
+        self.lock = threading.Lock()
+
+
+    def get(self, key, replay_file, cutoff, fmt, tracker_names):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.in_flight[key] = self.executor.submit(render_figures, replay_file, cutoff, fmt, tracker_names)
+
+        try:
+            figures = future.result()
+        except BaseException:
+            # failed renders aren't cached, the next request tries again
+            with self.lock:
+                self.in_flight.pop(key, None)
+            raise
+
+        # in one go, so that no request can find the key neither in flight nor cached and render it again
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if key not in self.entries:
+                self.entries[key] = figures
+                self.size += sum(len(figure) for figure in figures)
+                while self.size > self.max_size and len(self.entries) > 1:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= sum(len(figure) for figure in evicted)
+
+        return figures
+
+
+def resolve_replay(replay):
+    """ Accepts a name or a path of a file in the replays directory """
+    # don't let requests wander outside of the replays directory
+    path = os.path.join(os.path.abspath(replays_dir), os.path.basename(replay))
+    if os.path.isfile(path) and (os.path.basename(replay) == replay or os.path.abspath(replay) == path):
+        return path
+
+    raise SC2SkillTrackerException(f"Replay not found: {replay}")
+
+
+class PlotRequestHandler(BaseHTTPRequestHandler):
+    render_cache = None # set by run()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        try:
+            if url.path == '/':
+                self.send_index()
+            elif url.path == '/plot':
+                self.send_plot(parse_qs(url.query))
+            else:
+                self.send_error(404)
+        except SC2SkillTrackerException as e:
+            self.send_error(400, str(e))
+        except Exception: # sc2reader, matplotlib or a tracker failing on the replay - answer rather than hang up
+            traceback.print_exc()
+            self.send_error(500, "Internal error, see the server log")
+
+
+    def send_index(self):
+        index = ReplayIndex() # sqlite connections can't be shared between threads, kept up to date by refresh_index()
+        links = ''.join(f'<li><a href="/plot?replay={quote(os.path.basename(path))}">{html.escape(os.path.basename(path))}</a></li>'
+                        for path, _, error in index.recent(replays_dir, 50) if error is None)
+        self.send_body(f'<html><body><ul>{links}</ul></body></html>'.encode('utf-8'), 'text/html; charset=utf-8')
+
+
+    def send_plot(self, query):
+        def param(name, default=None):
+            return query[name][0] if name in query else default
+
+        if param('replay') is None:
+            raise SC2SkillTrackerException("Missing replay parameter")
+        replay_file = resolve_replay(param('replay'))
+
+        fmt = param('format', 'png')
+        if fmt not in CONTENT_TYPES:
+            raise SC2SkillTrackerException(f"Unsupported format: {fmt}")
+
+        try:
+            cutoff = parse_timestamp(param('cutoff')) if param('cutoff') is not None else None
+            player = int(param('player', 0))
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            raise SC2SkillTrackerException(str(e))
+
+        tracker_names = param('trackers').split(',') if param('trackers') is not None else list(PLOT_TRACKERS)
+
+        key = (file_hash(replay_file), cutoff, tuple(tracker_names), fmt)
+        figures = self.render_cache.get(key, replay_file, cutoff, fmt, tracker_names)
+        if not 0 <= player < len(figures):
+            raise SC2SkillTrackerException(f"No Zerg player {player}, there are {len(figures)}")
+
+        self.send_body(figures[player], CONTENT_TYPES[fmt])
+
+
+    def send_body(self, body, content_type):
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def refresh_index(interval, stop):
+    """ Updates the replay index every interval seconds until stop is set - the only writer while serving, so that
+        requests never wait on each other's updates
+    """
+    index = ReplayIndex()
+    while not stop.wait(interval):
+        try:
+            index.update(replays_dir)
+        except Exception: # keep serving the index as it is, the next update tries again
+            traceback.print_exc()
+
+
+def run(host, port, jobs, cache_size, index_interval=DEFAULT_INDEX_INTERVAL):
+    if replays_dir is None:
+        raise SC2SkillTrackerException(f"The server only serves replays of the replays directory, set {REPLAY_PATH_VAR}")
+
+    print("updating the replay index")
+    ReplayIndex().update(replays_dir, jobs)
+    stop = threading.Event()
+    threading.Thread(target=refresh_index, args=(index_interval, stop), daemon=True).start()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        PlotRequestHandler.render_cache = RenderCache(executor, cache_size)
+        with ThreadingHTTPServer((host, port), PlotRequestHandler) as server:
+            print(f"serving on http://{host}:{port}/")
+            try:
+                server.serve_forever()
+            finally:
+                stop.set()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
+    parser.add_argument('--host', type=str, default='127.0.0.1', dest='host', action='store', help='address to listen on (0.0.0.0 to let teammates in)')
+    parser.add_argument('--port', type=int, default=8000, dest='port', action='store', help='port to listen on')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), dest='jobs', action='store', help='number of worker processes rendering plots')
+    parser.add_argument('--index-interval', type=float, default=DEFAULT_INDEX_INTERVAL, dest='index_interval', action='store', help='seconds between updates of the replay index, for replays added while serving')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024), dest='cache_size', action='store', help='rendered figure cache size limit in MB')
+
+    args = parser.parse_args()
+
+    try:
+        run(args.host, args.port, args.jobs, args.cache_size * 1024 * 1024, args.index_interval)
+    except SC2SkillTrackerException as e:
+        print("Error: " + str(e))
+        sys.exit(1)
@@ -0,0 +1,53 @@
+""" Game end, and so what trends measure, doesn't depend on which trackers are in a pass over a synthetic replay """
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('sc2reader')
+
+from sc2reader.events import PlayerLeaveEvent
+
+from benchmarks.synthetic import generate_session, FRAMES_PER_SECOND
+from ..plot_trends import TrendEngine, LarvaSpendingTrend, InjectTrend
+from ..plotter import consume_replay, consume_replay_checkpoints
+
+LEAVE_SECOND = 360
+
+
+def session():
+    """ A game whose replay goes on for a while after a player left """
+    session = generate_session(minutes=6.5)
+    replay = session.replay
+    for event in replay.game_events:
+        if isinstance(event, PlayerLeaveEvent):
+            event.frame = LEAVE_SECOND * FRAMES_PER_SECOND
+            event.second = LEAVE_SECOND
+    replay.game_events.sort(key=lambda event: event.frame)
+    return session
+
+
+def measure(trends):
+    engine = TrendEngine(trends)
+    trackers, cutoffs, checkpoint, data_points = engine.riders(trends)
+    consume_replay_checkpoints(session(), list(trackers.values()), cutoffs, checkpoint)
+    return [data_points[trend] for trend in trends]
+
+
+def test_trends_alone_and_together():
+    for cutoff in [300, 370]:
+        larvae, injects = LarvaSpendingTrend(cutoff, 'orastem'), InjectTrend(cutoff, 'orastem')
+
+        assert measure([larvae, injects]) == measure([larvae]) + measure([injects])
+
+
+def test_game_end():
+    # until the player left, whichever trackers consume the events
+    assert session().length > LEAVE_SECOND
+    assert consume_replay(session(), [], 370) == LEAVE_SECOND
+    assert consume_replay(session(), [], None) == LEAVE_SECOND
+    assert consume_replay(session(), [], 300) == 300
+
+    # the larvae trend skips a replay that ended before its cutoff
+    assert measure([LarvaSpendingTrend(370, 'orastem')]) == [None]
+    assert measure([LarvaSpendingTrend(300, 'orastem')]) != [None]
+
@@ -0,0 +1,72 @@
+""" Events stored in the EventCache come back as they went in """
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('sc2reader')
+
+from ..event_cache import EVENT_FIELDS, CachedPlayer, CachedReplay, EventCache
+from ..replay_helpers import file_hash
+
+STRINGS = ['UnitBornEvent', 'Drone', 'PlayerStatsEvent', 'TargetUnitCommandEvent', 'SpawnLarva', 'UpgradeCompleteEvent',
+           'zerglingmovementspeed']
+
+#        kind frame player unit_id unit_type name target food_used food_made minerals vespene lost used
+ROWS = [(0,   0,    1,     10,     1,        -1,  -1,    0,        0,        0,       0,      0,   0),
+        (0,   0,    2,     20,     1,        -1,  -1,    0,        0,        0,       0,      0,   0),
+        (2,   160,  1,     -1,     -1,       -1,  -1,    13,       14,       55,      0,      0,   50),
+        (3,   300,  1,     -1,     -1,       4,   77,    0,        0,        0,       0,      0,   0),
+        (0,   320,  1,     11,     1,        -1,  -1,    0,        0,        0,       0,      0,   0),
+        (5,   480,  2,     -1,     -1,       6,   -1,    0,        0,        0,       0,      0,   0)]
+
+
+def replay():
+    players = [CachedPlayer(1, 'orastem', 'Zerg', True), CachedPlayer(2, 'opponent', 'Terran', True)]
+    return CachedReplay(np.array(ROWS, dtype=EVENT_FIELDS), STRINGS, players, 500)
+
+
+def summary(event):
+    """ Plain values of an event, units and players by ID """
+    attributes = {name: value for name, value in vars(event).items() if name not in ('unit', 'player')}
+    if 'unit' in vars(event):
+        attributes['unit'] = (event.unit.id, event.unit.name, event.unit.owner.pid)
+    if 'player' in vars(event):
+        attributes['player'] = event.player.pid
+    return type(event).__name__, attributes
+
+
+def test_round_trip(tmp_path):
+    replay_file = tmp_path / 'game.SC2Replay'
+    replay_file.write_bytes(b'not really a replay, only hashed')
+    original = replay()
+
+    cache = EventCache(str(tmp_path / 'events'))
+    # stored as if the replay had been decoded
+    cache._store(file_hash(str(replay_file)), original)
+    loaded = cache.load(str(replay_file))
+
+    assert isinstance(loaded.array, np.memmap)
+    assert loaded.frames == original.frames
+    assert [vars(player) for player in loaded.players] == [vars(player) for player in original.players]
+    assert [summary(event) for event in loaded.events()] == [summary(event) for event in original.events()]
+
+
+def test_events():
+    events = [summary(event) for event in replay().events()]
+
+    assert [name for name, _ in events] == ['UnitBornEvent', 'UnitBornEvent', 'PlayerStatsEvent', 'TargetUnitCommandEvent',
+                                            'UnitBornEvent', 'UpgradeCompleteEvent']
+    assert events[2][1] == {'frame': 160, 'second': 10, 'player': 1, 'food_used': 13, 'food_made': 14, 'minerals_current': 55,
+                            'vespene_current': 0, 'minerals_lost': 0, 'minerals_used_current': 50}
+    assert events[3][1] == {'frame': 300, 'second': 18, 'player': 1, 'target_unit_id': 77, 'ability': None,
+                            'ability_name': 'SpawnLarva'}
+    assert events[4][1]['unit'] == (11, 'Drone', 1)
+    assert events[5][1]['upgrade_type_name'] == 'zerglingmovementspeed'
+
+
+def test_events_filtered():
+    all_events = [summary(event) for event in replay().events()]
+
+    # only events before the frame
+    assert [summary(event) for event in replay().events(until=320)] == all_events[:4]
+    assert [summary(event) for event in replay().events(until=0)] == []
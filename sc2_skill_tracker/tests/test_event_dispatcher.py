@@ -0,0 +1,85 @@
+""" EventDispatcher routing by event type and player, with made up events and trackers """
+
+from types import SimpleNamespace
+
+from ..event_dispatch import EventDispatcher, event_player_id
+
+
+class Event(object):
+    def __init__(self, player=None, unit=None):
+        self.player = player
+        self.unit = unit
+
+
+class TrackerEvent(Event):
+    pass
+
+
+class UnitEvent(TrackerEvent):
+    pass
+
+
+class GameEvent(Event):
+    pass
+
+
+class Tracker(object):
+    def __init__(self, event_types=None, player_ids=None):
+        if event_types is not None:
+            self.EVENT_TYPES = event_types
+        self.player_ids = player_ids
+        self.events = []
+
+
+    def consume_event(self, event):
+        self.events.append(event)
+
+
+def player(pid):
+    return SimpleNamespace(pid=pid)
+
+
+def unit(owner):
+    return SimpleNamespace(owner=owner)
+
+
+def test_routes_by_event_type():
+    units = Tracker((UnitEvent,))
+    tracker_events = Tracker((TrackerEvent,)) # subclasses included
+    game = Tracker((GameEvent,))
+    events = [UnitEvent(unit=unit(player(1))), TrackerEvent(player(1)), GameEvent(player(1)), Event()]
+
+    dispatcher = EventDispatcher([units, tracker_events, game])
+    for event in events:
+        dispatcher.dispatch(event)
+
+    assert units.events == events[:1]
+    assert tracker_events.events == events[:2]
+    assert game.events == events[2:3]
+
+
+def test_trackers_without_event_types_get_everything():
+    everything = Tracker()
+    events = [UnitEvent(unit=unit(player(1))), TrackerEvent(player(2)), GameEvent(), Event()]
+
+    dispatcher = EventDispatcher([Tracker((GameEvent,)), everything])
+    for event in events:
+        dispatcher.dispatch(event)
+
+    assert everything.events == events
+
+
+def test_filters_by_player():
+    mine = Tracker((Event,), player_ids={1})
+    anyone = Tracker((Event,))
+    events = [UnitEvent(unit=unit(player(1))), UnitEvent(unit=unit(player(2))), UnitEvent(unit=unit(None)),
+              TrackerEvent(player(1)), TrackerEvent(player(2)), GameEvent()]
+
+    dispatcher = EventDispatcher([mine, anyone])
+    for event in events:
+        dispatcher.dispatch(event)
+
+    assert mine.events == [events[0], events[3]]
+    assert anyone.events == events
+    assert [event_player_id(event) for event in events] == [1, 2, None, 1, 2, None]
+
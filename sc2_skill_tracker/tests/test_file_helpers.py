@@ -0,0 +1,49 @@
+""" atomic_write and evict_lru on a temporary directory """
+
+import os
+
+import pytest
+
+from ..file_helpers import atomic_write, evict_lru
+
+
+def write(path, size, mtime):
+    with atomic_write(str(path), 'wb') as f:
+        f.write(b'x' * size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_atomic_write(tmp_path):
+    path = tmp_path / 'a' / 'entry.json'
+    with atomic_write(str(path)) as f:
+        f.write('complete')
+    assert path.read_text() == 'complete'
+
+    with pytest.raises(RuntimeError):
+        with atomic_write(str(path)) as f:
+            f.write('partial')
+            raise RuntimeError()
+
+    assert path.read_text() == 'complete'
+    assert os.listdir(path.parent) == ['entry.json']
+
+
+def test_evict_lru(tmp_path):
+    for i in range(4):
+        write(tmp_path / f'{i}.json', 10, 1000 + i)
+
+    evict_lru(str(tmp_path), 25)
+    assert sorted(os.listdir(tmp_path)) == ['2.json', '3.json']
+
+
+def test_evict_lru_entries(tmp_path):
+    # an entry is as recent as its most recent file, and goes as a whole
+    write(tmp_path / 'old.npy', 10, 1000)
+    write(tmp_path / 'old.json', 10, 1003)
+    write(tmp_path / 'new.npy', 10, 1001)
+    write(tmp_path / 'new.json', 10, 1002)
+
+    evict_lru(str(tmp_path), 20, lambda name: os.path.splitext(name)[0])
+    assert sorted(os.listdir(tmp_path)) == ['old.json', 'old.npy']
+
+    evict_lru(str(tmp_path / 'missing'), 0)
@@ -0,0 +1,83 @@
+""" The vectorised inject intervals against the per-hatchery loops they replaced, on random hatcheries """
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('sc2reader')
+
+from ..trackers.InjectTracker import InjectTracker, chain_injects, missed_injects, earliest_possible_inject
+
+INJECT_TIME = InjectTracker.INJECT_TIME
+
+
+def reference_chain(command_times):
+    injects = []
+    for time in command_times:
+        if injects and time < injects[-1][1]:
+            # queued, starts after the latest one finishes
+            injects.append((injects[-1][1], injects[-1][1] + INJECT_TIME))
+        else:
+            injects.append((time, time + INJECT_TIME))
+    return injects
+
+
+def reference_missed(injects, first_queen_creation, hatch_creation, hatch_cutoff):
+    if first_queen_creation is None or first_queen_creation > hatch_cutoff:
+        return []
+    earliest_possible = max(hatch_creation, first_queen_creation)
+
+    if not injects:
+        return [(earliest_possible, hatch_cutoff)]
+    return [(earliest_possible, injects[0][0]), (injects[-1][1], hatch_cutoff)] \
+           + [(injects[i-1][1], injects[i][0]) for i in range(1, len(injects))]
+
+
+def random_hatcheries(rng):
+    """ Returns [(creation, cutoff, sorted inject command times)] """
+    hatcheries = []
+    for _ in range(rng.integers(1, 6)):
+        creation = int(rng.integers(0, 300))
+        cutoff = creation + int(rng.integers(0, 600))
+        commands = sorted(int(time) for time in rng.integers(creation, cutoff + 1, rng.integers(0, 12)))
+        hatcheries.append((creation, cutoff, commands))
+    return hatcheries
+
+
+def as_arrays(per_hatch):
+    """ Flattens lists of values per hatchery into arrays (hatch, values) """
+    hatch = np.array([i for i, values in enumerate(per_hatch) for _ in values], dtype=int)
+    return hatch, np.array([value for values in per_hatch for value in values], dtype=float)
+
+
+def test_chain_injects():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        hatcheries = random_hatcheries(rng)
+        hatch, times = as_arrays([commands for _, _, commands in hatcheries])
+
+        start, end = chain_injects(hatch, times, INJECT_TIME)
+
+        expected = [inject for _, _, commands in hatcheries for inject in reference_chain(commands)]
+        assert list(zip(start, end)) == expected
+
+
+def test_missed_injects():
+    rng = np.random.default_rng(1)
+    for _ in range(200):
+        hatcheries = random_hatcheries(rng)
+        first_queen = None if rng.random() < 0.2 else int(rng.integers(0, 700))
+
+        # clamped to the hatchery's cutoff, like InjectTracker does
+        clamped = [[(start, min(end, cutoff)) for start, end in reference_chain(commands) if start < cutoff]
+                   for _, cutoff, commands in hatcheries]
+        hatch, start = as_arrays([[start for start, _ in injects] for injects in clamped])
+        _, end = as_arrays([[end for _, end in injects] for injects in clamped])
+        creation = np.array([creation for creation, _, _ in hatcheries], dtype=float)
+        cutoff = np.array([cutoff for _, cutoff, _ in hatcheries], dtype=float)
+
+        missed_hatch, missed_start, missed_end = missed_injects(hatch, start, end,
+                                                                earliest_possible_inject(creation, first_queen, cutoff), cutoff)
+
+        for i, (hatch_creation, hatch_cutoff, _) in enumerate(hatcheries):
+            missed = sorted(zip(missed_start[missed_hatch == i], missed_end[missed_hatch == i]))
+            assert missed == sorted(reference_missed(clamped[i], first_queen, hatch_creation, hatch_cutoff))
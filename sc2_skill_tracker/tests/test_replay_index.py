@@ -0,0 +1,91 @@
+""" ReplayIndex queries over replays added with made up metadata """
+
+import os
+
+from types import SimpleNamespace
+
+import pytest
+
+from ..replay_index import ReplayIndex
+from ..SC2SkillTrackerException import SC2SkillTrackerException
+
+
+def metadata(players, duration=600, map_name='Alcyone LE', error=None):
+    """ :param players: (name, race, is_human) """
+    players = [{'pid': pid, 'name': name, 'race': race, 'is_human': is_human}
+               for pid, (name, race, is_human) in enumerate(players, 1)]
+    return {'error': error, 'hash': f'hash-{len(players)}-{duration}', 'map_name': map_name, 'duration': duration,
+            'players': players, 'is_1v1_vs_human': len(players) == 2 and all(player['is_human'] for player in players)}
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = ReplayIndex(str(tmp_path / 'index.sqlite3'))
+    replays = [('zvt', metadata([('orastem', 'Zerg', True), ('someone', 'Terran', True)])),
+               ('tvz', metadata([('someone', 'Terran', True), ('orastem', 'Zerg', True)])),
+               ('zvp', metadata([('orastem', 'Zerg', True), ('other', 'Protoss', True)])),
+               ('zvt_short', metadata([('orastem', 'Zerg', True), ('someone', 'Terran', True)], duration=200)),
+               ('zvt_ai', metadata([('orastem', 'Zerg', True), ('A.I. 1 (Elite)', 'Terran', False)])),
+               ('2v2', metadata([('orastem', 'Zerg', True), ('mate', 'Zerg', True), ('a', 'Terran', True), ('b', 'Terran', True)])),
+               ('broken', metadata([], duration=None, map_name=None, error='ReadError: truncated')),
+               ('tvp', metadata([('someone', 'Terran', True), ('other', 'Protoss', True)]))]
+    # oldest first
+    for ctime, (name, data) in enumerate(replays):
+        index.add(path(tmp_path, name), SimpleNamespace(st_mtime=ctime, st_size=100, st_ctime=ctime), data)
+    return index
+
+
+def path(tmp_path, name):
+    return os.path.join(str(tmp_path), f'{name}.SC2Replay')
+
+
+def names(paths):
+    return [os.path.splitext(os.path.basename(path))[0] for path in paths]
+
+
+def test_query(index, tmp_path):
+    directory = str(tmp_path)
+    assert names(index.query(directory)) == ['tvp', '2v2', 'zvt_ai', 'zvt_short', 'zvp', 'tvz', 'zvt']
+    assert names(index.query(directory, 'orastem')) == ['2v2', 'zvt_ai', 'zvt_short', 'zvp', 'tvz', 'zvt']
+    # player's race first, only 1v1 games vs humans
+    assert names(index.query(directory, 'orastem', 'ZvT')) == ['zvt_short', 'tvz', 'zvt']
+    assert names(index.query(directory, 'orastem', 'zvt', min_duration=300)) == ['tvz', 'zvt']
+    assert names(index.query(directory, 'someone', 'TvZ')) == ['zvt_short', 'tvz', 'zvt']
+    assert names(index.query(directory, 'orastem', 'ZvT', limit=1)) == ['zvt_short']
+    # names match by prefix, like ReplayContext
+    assert names(index.query(directory, 'oras', 'ZvP')) == ['zvp']
+
+
+def test_query_invalid(index, tmp_path):
+    with pytest.raises(SC2SkillTrackerException):
+        index.query(str(tmp_path), matchup='ZvT')
+    with pytest.raises(SC2SkillTrackerException):
+        index.query(str(tmp_path), 'orastem', 'ZvTvP')
+
+
+def test_entries(index, tmp_path):
+    zvt = path(tmp_path, 'zvt')
+    assert [name for _, name, _, _ in index.players(zvt)] == ['orastem', 'someone']
+    assert index.error(path(tmp_path, 'broken')) == 'ReadError: truncated'
+    assert index.error(zvt) is None
+    assert names(path for path, _, _ in index.recent(str(tmp_path), 2)) == ['tvp', 'broken']
+
+    assert index.is_current(zvt, SimpleNamespace(st_mtime=0, st_size=100))
+    assert not index.is_current(zvt, SimpleNamespace(st_mtime=0, st_size=101))
+
+    index.remove(zvt)
+    assert index.players(zvt) == []
+    assert zvt not in index.hashes()
+
+
+def test_directories(index, tmp_path):
+    other = tmp_path / 'other'
+    other.mkdir()
+    index.add(str(other / 'zvt.SC2Replay'), SimpleNamespace(st_mtime=100, st_size=100, st_ctime=100),
+              metadata([('orastem', 'Zerg', True), ('someone', 'Terran', True)]))
+
+    # each directory only sees its own replays
+    assert names(index.query(str(tmp_path), 'orastem', 'ZvT')) == ['zvt_short', 'tvz', 'zvt']
+    assert index.query(str(other), 'orastem', 'ZvT') == [str(other / 'zvt.SC2Replay')]
+    assert names(path for path, _, _ in index.recent(str(tmp_path), 1)) == ['tvp']
+    assert [path for path, _, _ in index.recent(str(other))] == [str(other / 'zvt.SC2Replay')]
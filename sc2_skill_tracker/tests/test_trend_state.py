@@ -0,0 +1,67 @@
+""" TrendState's running fits against least squares refitted from scratch """
+
+import random
+
+import pytest
+
+from ..trend_state import TrendState
+
+
+def refit(points):
+    """ Returns (intercept, slope) of a least squares line through points """
+    np = pytest.importorskip('numpy')
+    x, y = zip(*points)
+    slope, intercept = np.polyfit(x, y, 1)
+    return intercept, slope
+
+
+def test_fits_match_refit():
+    rng = random.Random(0)
+    state = TrendState(overall_size=50, recent_size=15)
+    usable = []
+    for i in range(200):
+        value = None if rng.random() < 0.3 else rng.gauss(10, 3) + 0.05 * i
+        state.add(f'replay{i}', value)
+        if value is not None:
+            usable.append((len(usable), value))
+
+        for window, size in [(state.overall, 50), (state.recent, 15)]:
+            expected = usable[-size:]
+            assert list(window.points) == expected
+            if len(expected) < 2:
+                assert window.line() is None
+            else:
+                assert window.line() == pytest.approx(refit(expected), rel=1e-6, abs=1e-6)
+
+    assert state.count == len(usable)
+
+
+def test_save_load(tmp_path):
+    state = TrendState(overall_size=5, recent_size=2)
+    for i, value in enumerate([1.0, None, 3.0, 2.0, 5.0, 4.0, None, 6.0]):
+        state.add(f'replay{i}', value)
+
+    path = str(tmp_path / 'state.json')
+    state.save(path)
+    loaded = TrendState.load(path, 5, 2)
+    assert loaded.seen() == state.seen()
+    assert loaded.count == state.count
+    assert loaded.overall.line() == state.overall.line()
+    assert loaded.recent.line() == state.recent.line()
+
+    # fits over other windows can't be derived from the stored one
+    assert TrendState.load(path, 10, 2).seen() == (None, 0, '')
+
+
+def test_pending():
+    replays = [f'replay{i}' for i in range(10)]
+    state = TrendState()
+    assert state.pending(replays) is None
+
+    for replay in replays[2:6]:
+        state.add(replay, 1.0)
+    assert state.pending(replays) == replays[6:]
+    # a replay it saw was deleted
+    assert state.pending(replays[:3] + replays[4:]) is None
+    # an older replay was added in between
+    assert state.pending(replays[:4] + ['older'] + replays[4:]) is None
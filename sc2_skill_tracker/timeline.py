@@ -0,0 +1,82 @@
+"""
+A shared time grid that tracker outputs are resampled onto, so that every plot uses the same x-axis (game seconds) and
+metrics of different trackers line up sample for sample - cross-metric measurements (e.g. larvae banked while supply
+blocked) are then plain array operations.
+
+Counts (supply, resources, larvae, drones) are step-held: the value at a grid point is the last one recorded at or
+before it. Intervals (injects) become boolean masks over the grid.
+"""
+
+import numpy as np
+
+from .replay_helpers import timestamp, real_seconds
+
+
+class Timeline(object):
+    """ Grid points 0, step, 2*step... before end, each standing for the period until the next one """
+    def __init__(self, end, step=1):
+        """ :param end: in game seconds, e.g. the cutoff time of the replay
+            :param step: grid resolution in game seconds
+        """
+        self.end = end
+        self.step = step
+        self.times = np.arange(0, end, step, dtype=float)
+
+
+    def __len__(self):
+        return len(self.times)
+
+
+    @property
+    def edges(self):
+        """ Boundaries of the grid points' periods - one more than times, ending at end (for Axes.stairs()) """
+        return np.append(self.times, self.end)
+
+
+    def step_hold(self, times, values):
+        """ Resamples values recorded at times (sorted) onto the grid, holding each value until the next one. Grid
+            points before the first recorded value get the first value.
+        """
+        values = np.asarray(values)
+        if len(values) == 0:
+            return np.zeros(len(self), dtype=values.dtype)
+
+        indices = np.searchsorted(times, self.times, side='right') - 1
+        return values[np.maximum(indices, 0)]
+
+
+    def interval_masks(self, row, start, end, rows):
+        """ Returns boolean masks of intervals [start, end) in several rows (e.g. one per hatchery), True at grid
+            points within any of the row's intervals
+            :param row: row of each interval, in range(rows)
+            :return: boolean array of shape (rows, len(self))
+        """
+        # +1 where an interval starts and -1 where it ends, the running sum is then the number of intervals covering
+        # a grid point (overlapping intervals are fine)
+        counts = np.zeros((rows, len(self) + 1), dtype=np.int32)
+        np.add.at(counts, (row, np.searchsorted(self.times, start, side='left')), 1)
+        np.add.at(counts, (row, np.searchsorted(self.times, end, side='left')), -1)
+        return np.cumsum(counts[:, :-1], axis=1) > 0
+
+
+    def mean(self, values, mask=None):
+        """ Time-weighted mean of resampled values, over the grid points of mask if given (NaN if there are none) """
+        values = np.asarray(values, dtype=float)
+        if mask is not None:
+            values = values[mask]
+        return float(values.mean()) if len(values) else float('nan')
+
+
+    def format_axes(self, axes):
+        """ Limits the x-axis to the grid and labels it with (real) timestamps - the same on every Axes """
+        from matplotlib.ticker import FuncFormatter
+
+        def x_to_timestamp(x, pos):
+            """ :param x: position alongside the axis in data space (game seconds), can be negative if there's a margin
+                :param pos: index of the tick being drawn, None otherwise (e.g. when moving the mouse cursor around)
+            """
+            if x >= 0:
+                return timestamp(real_seconds(x))
+
+        axes.xaxis.set_major_formatter(FuncFormatter(x_to_timestamp))
+        axes.set_xlim(0, self.end)
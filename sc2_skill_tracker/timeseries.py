@@ -0,0 +1,42 @@
+import numpy as np
+
+
+class TimeSeries(object):
+    """ Table of typed NumPy columns that trackers append samples to. Columns grow geometrically, so appending is
+        amortised O(1), and series[column_name] is a NumPy view of the samples so far - ready for vectorised maths and
+        plotting, without per-sample dicts.
+
+        Views are only valid until the next append (it may reallocate), so take them once the replay is consumed.
+    """
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, **dtypes):
+        """ :param dtypes: column name -> NumPy dtype """
+        self._columns = {name: np.empty(TimeSeries.INITIAL_CAPACITY, dtype=dtype) for name, dtype in dtypes.items()}
+        self._length = 0
+
+
+    def append(self, **values):
+        """ Appends a sample - values for all columns, by name """
+        if self._length == len(next(iter(self._columns.values()))):
+            for name, column in self._columns.items():
+                grown = np.empty(2 * len(column), dtype=column.dtype)
+                grown[:self._length] = column
+                self._columns[name] = grown
+
+        for name, column in self._columns.items():
+            column[self._length] = values[name]
+        self._length += 1
+
+
+    def __len__(self):
+        return self._length
+
+
+    def __getitem__(self, name):
+        return self._columns[name][:self._length]
+
+
+    @property
+    def columns(self):
+        return list(self._columns.keys())
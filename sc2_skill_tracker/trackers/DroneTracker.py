@@ -1,88 +1,82 @@
 import numpy as np
 
-from matplotlib.ticker import FuncFormatter
-from ..replay_helpers import Entity, timestamp, real_seconds, game_seconds
+from ..replay_context import UnitType
+from ..replay_helpers import real_seconds
+from ..timeseries import TimeSeries
 
 from sc2reader.events import UnitBornEvent, UnitDiedEvent
 
-# just a heuristic - the target is number of (real) minutes * 10 (interpolated)
+# target drone counts - (real seconds, drones) breakpoints, interpolated linearly between them and flat after the last.
+# Just a heuristic - the target is number of (real) minutes * 10, up to 80 at 8:00; 13 drones at second 0 (including
+# the one immediately queued) and it seems like 22 drones are normally hit at 2:12
+TARGET_BREAKPOINTS = [(0, 13), (132, 22), (480, 80)]
+
+
 def target_drone_count(time_axis):
-    for time in time_axis:
-        min_sec = [int(x) for x in timestamp(real_seconds(time)).split(':')]
-        if min_sec[0] >= 8:
-            yield 80
-        elif real_seconds(time) < 133:
-            # 13 drones at second 0 (including the one immediately queued) and it seems like
-            # 22 drones are normally hit at 2:12 (real seconds)
-            yield 13 + time/game_seconds(132) * 9
-        else:
-            yield min_sec[0] * 10 + (min_sec[1] / 60) * 10
+    """ :param time_axis: NumPy array of game seconds
+        :return: NumPy array of target drone counts at time_axis
+    """
+    real_times, drones = zip(*TARGET_BREAKPOINTS)
+    return np.interp(real_seconds(np.asarray(time_axis)), real_times, drones)
 
 class DroneTracker(object):
+    EVENT_TYPES = (UnitBornEvent, UnitDiedEvent)
+
     def __init__(self, player_name):
         self.player_name = player_name
+        self.player_ids = None # set by resolve()
+        self.context = None
         self.drone_count = 0
-        self.data = []
+        self.data = TimeSeries(time=np.int32, drones=np.int32)
         self.title = "Drones"
 
+    def resolve(self, context):
+        # the dispatcher only passes on events of our player's units
+        self.context = context
+        self.player_ids = context.player_ids(self.player_name)
+
     # larvae and drones at the start of the game are 'born' just like any subsequent ones
 
     def consume_event(self, event):
         # TODO when a drone morphs into a building, it 'dies' only once the building is complete (which makes sense,
         # the building can always be cancelled). But, its supply should be subtracted at the start of the morph,
         # which we don't do here (only once it dies). The event triggered at the start has type UnitInitEvent.
-        if (isinstance(event, UnitBornEvent)
-             and event.unit.owner is not None
-             and event.unit.owner.name.startswith(self.player_name)
-             and event.unit.name == Entity.DRONE):
+        if self.context.unit_code(event.unit) != UnitType.DRONE:
+            return
+
+        if isinstance(event, UnitBornEvent):
             self.drone_count += 1
-            self.data.append({'time' : event.second,
-                              'drones' : self.drone_count})
-        elif (isinstance(event, UnitDiedEvent)
-             and event.unit.owner is not None
-             and event.unit.owner.name.startswith(self.player_name)
-             and event.unit.name == Entity.DRONE):
+        else: # UnitDiedEvent
             self.drone_count -= 1
-            self.data.append({'time' : event.second,
-                              'drones' : self.drone_count})
+        self.data.append(time=event.second, drones=self.drone_count)
 
 
-    def plot(self, axes, cutoff_time):
-        """ :param cutoff_time: end time for the plot x-axis (so that all plots are aligned)
-        """
-        def x_to_timestamp(x, pos):
-            """ Converts time (in game seconds) into timestamp string (in real minutes and seconds)
-                :param x: appears to be the position alongside respective Axis (could be y-axis)
-                          IN DATA SPACE (i.e. interpolated from actual data, not pixel values);
-                          can include some negative numbers if there's a margin
-                :param pos: appears to be the index of tick being drawn (None otherwise
-                            e.g. when moving mouse cursor around - x is still updated)
-            """
-            if x >= 0:
-                return timestamp(real_seconds(x))
-
-        axes.xaxis.set_major_formatter(FuncFormatter(x_to_timestamp))
-        axes.set_xlim(right=cutoff_time, auto=True)
-
-        actual_x_axis = [event['time'] for event in self.data]
+    def resample(self, timeline):
+        """ Returns drone counts (actual, step-held) and target on the Timeline's grid, as a dict of arrays """
+        return {'drones': timeline.step_hold(self.data['time'], self.data['drones']),
+                'target': target_drone_count(timeline.times)}
 
+
+    def plot(self, axes, timeline, bands=None):
+        """ :param timeline: Timeline to plot on, until the cutoff (so that all plots are aligned)
+            :param bands: CorpusBands to compare with instead of the target profile, if any
+        """
         # we should not have consumed events past the requested cutoff_time point
-        assert(self.data[-1]['time'] <= cutoff_time)
+        assert(len(self.data) == 0 or self.data['time'][-1] <= timeline.end)
 
-        # extend until the requested time so that all graphs align
-        actual_x_axis.append(cutoff_time)
+        # the grid is dense enough to get the inflection points of the target exactly right
+        resampled = self.resample(timeline)
+        drone_plot = axes.stairs(resampled['drones'], timeline.edges, baseline=None, color='tab:red', label='drones actual')
+        if bands is not None:
+            axes.legend(handles=[drone_plot, bands.plot(axes, 'drones', timeline, 'tab:blue', 'drones in corpus')], loc='upper left')
+            return
 
-        # repeat last recorded drone count at plot end
-        drone_plot, = axes.step(actual_x_axis, [event['drones'] for event in self.data] + [self.data[-1]['drones']], color='tab:red', label='drones actual')
         target_sub = axes.twinx() # Create a twin Axes sharing the xaxis
 
         # set the same limits so both graphs are scaled the same, i.e. we can visually
         # compare the actual and target drone counts
         target_sub.set_ylim(axes.get_ylim())
 
-        # using denser x-axis data to get the inflection point exactly right, otherwise, if no drone was
-        # built or killed at that moment, we won't plot it and the target plot will have too many segments
-        target_x_axis = np.arange(cutoff_time)
-        drone_target_plot, = target_sub.plot(target_x_axis, [x for x in target_drone_count(target_x_axis)], color='tab:blue', label='drones target')
+        drone_target_plot, = target_sub.plot(timeline.times, resampled['target'], color='tab:blue', label='drones target')
 
         axes.legend(handles=[drone_plot, drone_target_plot], loc='upper left')
@@ -2,19 +2,23 @@
   was diverted (or killed), the inject will still be counted. If a queen has to walk, timing will be off.
 """
 
-import matplotlib.patches as mpatches
+import itertools
 
-from matplotlib.ticker import FuncFormatter
-from ..replay_helpers import Entity, timestamp, real_seconds
+import numpy as np
+
+from .. import profiling
+from ..replay_context import UnitType, TOWN_HALLS
 from sc2reader.events.tracker import UnitBornEvent, UnitDoneEvent, UnitDiedEvent
-from sc2reader.events.game import TargetUnitCommandEvent, PlayerLeaveEvent
+from sc2reader.events.game import TargetUnitCommandEvent
 
 
 def earliest_possible_inject(hatch_creation, first_queen_creation, hatch_cutoff):
-    if first_queen_creation is None or first_queen_creation > hatch_cutoff:
-        return None
+    """ Per hatchery (arrays), NaN where no inject was possible before the hatchery's cutoff """
+    if first_queen_creation is None:
+        return np.full(np.shape(hatch_creation), np.nan)
 
-    return max(hatch_creation, first_queen_creation)
+    earliest_possible = np.maximum(hatch_creation, first_queen_creation, dtype=float)
+    return np.where(first_queen_creation > hatch_cutoff, np.nan, earliest_possible)
 
 
 def no_queen_period(hatch_creation, hatch_cutoff, first_queen_creation):
@@ -24,170 +28,233 @@ def no_queen_period(hatch_creation, hatch_cutoff, first_queen_creation):
 
     Arguments:
         first_queen_creation: may be None
+        hatch_creation, hatch_cutoff: scalars or arrays (per hatchery)
     """
     if first_queen_creation is None:
         return hatch_cutoff - hatch_creation
     else:
-        return min(hatch_cutoff, first_queen_creation) - min(hatch_creation, first_queen_creation)
+        return np.minimum(hatch_cutoff, first_queen_creation) - np.minimum(hatch_creation, first_queen_creation)
+
 
+def chain_injects(hatch, command_times, inject_time):
+    """ Inject intervals from the times of inject commands, sorted by hatchery and time.
 
-def missed_injects(injects, first_queen_creation, hatch_creation, hatch_cutoff):
+    An inject issued while the hatchery is still injected is queued, it starts when the previous one ends:
+    start[j] = max(time[j], start[j-1] + inject_time), which unrolls to a running maximum over the hatchery's
+    commands: start[j] = max(time[i] - inject_time*i for i <= j) + inject_time*j
+
+    Returns:
+        arrays start, end
+    """
+    if len(command_times) == 0:
+        return np.empty(0), np.empty(0)
+
+    first_of_hatch = np.r_[True, hatch[1:] != hatch[:-1]]
+    first_indices = np.flatnonzero(first_of_hatch)
+    # index of each command among its hatchery's commands
+    position = np.arange(len(command_times)) - np.repeat(first_indices, np.diff(np.r_[first_indices, len(command_times)]))
+
+    shifted = command_times - inject_time * position
+    # lift each hatchery's values above all of the previous hatcheries', so that the running maximum starts over
+    lift = (shifted.max() - shifted.min() + 1) * np.cumsum(first_of_hatch)
+    start = np.maximum.accumulate(shifted + lift) - lift + inject_time * position
+
+    return start, start + inject_time
+
+
+def missed_injects(hatch, start, end, earliest_possible, hatch_cutoff):
     """
     Arguments:
-        injects: list of (start, end) pairs, clamped to hatch_cutoff
+        hatch, start, end: inject intervals sorted by hatchery and time, clamped to hatch_cutoff
+        earliest_possible, hatch_cutoff: per hatchery, see earliest_possible_inject()
     Returns:
-        pairs (start, end) of missed inject periods
+        arrays hatch, start, end of missed inject periods
     """
-    earliest_possible = earliest_possible_inject(hatch_creation, first_queen_creation, hatch_cutoff)
-    if earliest_possible is None:
-        return []
-
-    missed = []
-    if injects:
-        # idle time from earliest_possible_inject until first inject (must be >= 0, inject must happen after a queen
-        # is born)
-        missed.append((earliest_possible, injects[0][0]))
-
-        # idle time from last inject until game end or death
-        missed.append((injects[-1][1], hatch_cutoff))
-    else:
-        # never injected - plot idle time from earliest possible inject (hatch_creation or queen born) until hatch_cutoff
-        # watch out in case hatchery died before the first queen was born
-        if first_queen_creation is not None:
-            missed.append((max(first_queen_creation, hatch_creation), hatch_cutoff))
-        # no missed injects if there was never any queen
-
-    if len(injects) > 1:
-        # idle time between injects
-        missed += [(injects[i-1][1], injects[i][0]) for i in range(1, len(injects))]
+    possible = ~np.isnan(earliest_possible)
+    last_of_hatch = np.r_[hatch[1:] != hatch[:-1], True] if len(hatch) else np.empty(0, dtype=bool)
+    first_of_hatch = np.r_[True, last_of_hatch[:-1]] if len(hatch) else last_of_hatch
+    between = np.flatnonzero(~first_of_hatch)
+    never_injected = np.flatnonzero(possible & (np.bincount(hatch, minlength=len(hatch_cutoff)) == 0))
+
+    missed_hatch = np.concatenate([
+        hatch[first_of_hatch], # idle time from earliest_possible_inject until the first inject (must be >= 0, inject
+                               # must happen after a queen is born)
+        hatch[last_of_hatch], # idle time from last inject until game end or death
+        hatch[between], # idle time between injects
+        never_injected]) # idle time from earliest possible inject until hatch_cutoff
+    missed_start = np.concatenate([earliest_possible[hatch[first_of_hatch]], end[last_of_hatch], end[between - 1],
+                                   earliest_possible[never_injected]])
+    missed_end = np.concatenate([start[first_of_hatch], hatch_cutoff[hatch[last_of_hatch]], start[between],
+                                 hatch_cutoff[never_injected]])
+
+    # no missed injects if no inject was ever possible
+    keep = possible[missed_hatch]
+    return missed_hatch[keep], missed_start[keep], missed_end[keep]
+
+
+def injected_fraction(resampled):
+    """ Fraction of the hatcheries that could be injected (injected or missing an inject) that are, at every grid
+    point - NaN where there are none.
 
-    return missed
+    Arguments:
+        resampled: see InjectTracker.resample()
+    """
+    injected = np.count_nonzero(resampled['injected'], axis=0)
+    possible = np.count_nonzero(resampled['injected'] | resampled['missed'], axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(possible > 0, injected / possible, np.nan)
 
 
 class InjectTracker(object):
     INJECT_TIME = 40 # in game seconds, according to https://github.com/dsjoerg/ggpyjobs/blob/master/sc2parse/plugins.py
 
+    EVENT_TYPES = (UnitBornEvent, UnitDoneEvent, UnitDiedEvent, TargetUnitCommandEvent)
+
     def __init__(self, player_name):
         self.player_name = player_name
+        self.player_ids = None # set by resolve()
+        self.context = None
         self.first_queen_time = None
         self.hatchery_history = {}
         self.title = "Injects"
 
+    def resolve(self, context):
+        # the dispatcher only passes on events of our player (and our player's units)
+        self.context = context
+        self.player_ids = context.player_ids(self.player_name)
+
     def consume_event(self, event):
-        # the initial hatchery is "born", subsequent ones are "done"
-        # As a Hatchery becomes a Lair and Hive, its ID doesn't change so events can show e.g. a Hive
-        # right at the start of the game.
-        if isinstance(event, UnitBornEvent) \
-           and event.unit.owner is not None \
-           and event.unit.owner.name.startswith(self.player_name) \
-           and (event.unit.name == "Hatchery" or event.unit.name == "Lair" or event.unit.name == "Hive"):
-            self.hatchery_history[event.unit_id] = {'injects': [], 'created': event.second, 'destroyed': None}
-
-        elif isinstance(event, UnitDoneEvent) \
-             and event.unit.owner is not None \
-             and event.unit.owner.name.startswith(self.player_name) \
-             and (event.unit.name == "Hatchery" or event.unit.name == "Lair" or event.unit.name == "Hive"):
-            self.hatchery_history[event.unit_id] = {'injects': [], 'created': event.second, 'destroyed': None}
-
-        elif isinstance(event, UnitDiedEvent) \
-             and event.unit.owner is not None \
-             and event.unit.owner.name.startswith(self.player_name) \
-             and (event.unit.name == "Hatchery" or event.unit.name == "Lair" or event.unit.name == "Hive"):
-            try:
-                self.hatchery_history[event.unit_id]['destroyed'] = event.second
-            except KeyError:
-                # if the hatchery never finished, we don't record its death
-                pass
-
-        elif isinstance(event, TargetUnitCommandEvent) \
-             and event.player.name is not None \
-             and event.player.name.startswith(self.player_name) \
-             and hasattr(event, "ability") \
-             and event.ability_name == "SpawnLarva" \
-             and event.target_unit_id in self.hatchery_history:
-
-            inject_intervals = self.hatchery_history[event.target_unit_id]['injects']
-
-            if inject_intervals and event.second < inject_intervals[-1][1]:
-                # queueing inject, starts after the latest one finishes (may be queued itself)
-                current_inject_end = inject_intervals[-1][1]
-                inject_intervals.append((current_inject_end, current_inject_end+InjectTracker.INJECT_TIME))
-            else:
-                # fresh inject, starts now
+        if isinstance(event, TargetUnitCommandEvent):
+            if hasattr(event, "ability") \
+               and event.ability_name == "SpawnLarva" \
+               and event.target_unit_id in self.hatchery_history:
+
+                # queued injects are chained in inject_intervals()
                 # XXX if the queen has to travel, this will be inaccurate; the total time should
                 #     be right, though - the idle time will just be shifted from before to after the inject
-                inject_intervals.append((event.second, event.second+InjectTracker.INJECT_TIME))
+                self.hatchery_history[event.target_unit_id]['inject_commands'].append(event.second)
+            return
 
-        elif isinstance(event, UnitBornEvent) \
-             and event.unit.name == "Queen" \
-             and event.unit.owner.name.startswith(self.player_name) \
+        unit_code = self.context.unit_code(event.unit)
+
+        # the initial hatchery is "born", subsequent ones are "done"
+        # As a Hatchery becomes a Lair and Hive, its ID doesn't change so events can show e.g. a Hive
+        # right at the start of the game.
+        if unit_code in TOWN_HALLS:
+            if isinstance(event, (UnitBornEvent, UnitDoneEvent)):
+                self.hatchery_history[event.unit_id] = {'inject_commands': [], 'created': event.second, 'destroyed': None}
+            elif isinstance(event, UnitDiedEvent):
+                try:
+                    self.hatchery_history[event.unit_id]['destroyed'] = event.second
+                except KeyError:
+                    # if the hatchery never finished, we don't record its death
+                    pass
+
+        elif unit_code == UnitType.QUEEN \
+             and isinstance(event, UnitBornEvent) \
              and self.first_queen_time is None:
             self.first_queen_time = event.second
 
 
-    def inject_history(self, hatchery_index, cutoff_time):
-        sorted_hatcheries = sorted(self.hatchery_history.values(), key=lambda value: value['created'])
+    def inject_intervals(self, cutoff_time):
+        """ Inject history of all hatcheries at once, hatcheries sorted by creation time. Returns a dict of arrays:
+            per hatchery - hatch_creation, hatch_cutoff (death or cutoff_time, whichever is earlier),
+                           earliest_possible (NaN if no inject was possible), proportion_injected
+            per inject interval and per missed inject period (sorted by hatchery and time) - hatch, start, end
+        """
+        with profiling.phase('inject_history'):
+            hatcheries = sorted(self.hatchery_history.values(), key=lambda value: value['created'])
 
-        hatchery = sorted_hatcheries[hatchery_index]
-        injects = hatchery['injects']
-        hatch_creation = hatchery['created']
+            hatch_creation = np.array([hatchery['created'] for hatchery in hatcheries], dtype=float)
+            destroyed = np.array([np.nan if hatchery['destroyed'] is None else hatchery['destroyed'] for hatchery in hatcheries], dtype=float)
 
-        # we should not have consumed events past the requested cutoff_time point
-        assert(hatch_creation <= cutoff_time)
-        assert(hatchery['destroyed'] is None or hatchery['destroyed'] <= cutoff_time)
+            # we should not have consumed events past the requested cutoff_time point
+            assert(np.all(hatch_creation <= cutoff_time))
+            assert(not np.any(destroyed > cutoff_time))
 
-        hatch_cutoff = cutoff_time if hatchery['destroyed'] is None else hatchery['destroyed']
+            hatch_cutoff = np.where(np.isnan(destroyed), cutoff_time, destroyed)
 
-        # clamp inject intervals to cutoff time or hatchery death - late or stacked injects could
-        # be computed to finish after the cutoff or even game end
-        clamped_injects = [(interval[0], min(hatch_cutoff, interval[1])) for interval in injects if interval[0] < hatch_cutoff]
+            command_counts = [len(hatchery['inject_commands']) for hatchery in hatcheries]
+            hatch = np.repeat(np.arange(len(hatcheries)), np.array(command_counts, dtype=int))
+            command_times = np.fromiter(itertools.chain.from_iterable(hatchery['inject_commands'] for hatchery in hatcheries),
+                                        dtype=float, count=sum(command_counts))
+            start, end = chain_injects(hatch, command_times, InjectTracker.INJECT_TIME)
 
-        # don't count time before the first queen is born as missed inject time
-        inject_possible_time = earliest_possible_inject(hatch_creation, self.first_queen_time, hatch_cutoff)
-        if inject_possible_time is None or hatch_cutoff - inject_possible_time == 0:
-            proportion_injected = 0
-        else:
-            total_injected = sum([interval[1] - interval[0] for interval in clamped_injects])
-            proportion_injected = total_injected / (hatch_cutoff - inject_possible_time)
+            # clamp inject intervals to cutoff time or hatchery death - late or stacked injects could
+            # be computed to finish after the cutoff or even game end
+            keep = start < hatch_cutoff[hatch]
+            hatch, start = hatch[keep], start[keep]
+            end = np.minimum(end[keep], hatch_cutoff[hatch])
 
-        return {'injects' : clamped_injects,
-                'proportion_injected': proportion_injected, # for convenience - could be inferred from others (mostly)
-                'hatch_creation': hatch_creation,
-                'hatch_cutoff': hatch_cutoff} # death or cutoff_time, whichever is earlier
+            # don't count time before the first queen is born as missed inject time
+            earliest_possible = earliest_possible_inject(hatch_creation, self.first_queen_time, hatch_cutoff)
+            inject_possible_time = hatch_cutoff - earliest_possible
+            total_injected = np.bincount(hatch, weights=end - start, minlength=len(hatcheries))
+            with np.errstate(divide='ignore', invalid='ignore'):
+                proportion_injected = np.where(inject_possible_time > 0, total_injected / inject_possible_time, 0)
 
+            missed_hatch, missed_start, missed_end = missed_injects(hatch, start, end, earliest_possible, hatch_cutoff)
+
+            return {'hatch_creation': hatch_creation,
+                    'hatch_cutoff': hatch_cutoff,
+                    'earliest_possible': earliest_possible,
+                    'proportion_injected': proportion_injected,
+                    'injects': (hatch, start, end),
+                    'missed': (missed_hatch, missed_start, missed_end)}
 
-    def plot(self, axes, cutoff_time):
-        """ cutoff_time - end time for the plot x-axis (so that all plots are aligned)
-        """
-        def x_to_timestamp(x, pos):
-            if x >= 0:
-                return timestamp(real_seconds(x))
 
-        axes.xaxis.set_major_formatter(FuncFormatter(x_to_timestamp))
-        axes.set_xlim(right=cutoff_time, auto=True)
+    def inject_history(self, hatchery_index, cutoff_time):
+        """ Inject history of one hatchery (by creation order) - prefer inject_intervals() for more than one """
+        intervals = self.inject_intervals(cutoff_time)
+        hatch, start, end = intervals['injects']
+        mask = hatch == hatchery_index
 
-        proportion_injected = []
-        # plot hatcheries sorted by hatch_creation time
-        for hatch_index in range(len(self.hatchery_history)):
-            history = self.inject_history(hatch_index, cutoff_time)
+        return {'injects' : list(zip(start[mask].tolist(), end[mask].tolist())),
+                'proportion_injected': float(intervals['proportion_injected'][hatchery_index]), # for convenience - could be inferred from others (mostly)
+                'hatch_creation': float(intervals['hatch_creation'][hatchery_index]),
+                'hatch_cutoff': float(intervals['hatch_cutoff'][hatchery_index])} # death or cutoff_time, whichever is earlier
 
-            # plot all injected intervals
-            axes.broken_barh([(interval[0], interval[1]-interval[0]) for interval in history['injects']],
-                             (5*hatch_index, 2), facecolors='tab:green', alpha=0.9)
 
-            # outside of injected intervals, we need to plot times when the hatchery existed but:
-            #  1. first queen wasn't born yet (when injects were not possible) - greyed out "no inject possible" period
-            #  2. queens (had) existed, but hatchery wasn't injected - red "missed inject" periods
+    def resample(self, timeline):
+        """ Inject history on the Timeline's grid - a dict of boolean arrays of shape (hatcheries, grid points), by
+            hatchery creation order: injected, missed and no_queen (hatchery existed before the first queen)
+        """
+        intervals = self.inject_intervals(timeline.end)
+        hatcheries = len(intervals['hatch_creation'])
+        no_queen = no_queen_period(intervals['hatch_creation'], intervals['hatch_cutoff'], self.first_queen_time)
 
-            # greyed-out time from hatch_creation until the first queen is born
-            # if hatch_creation is after the first queen, no_queen will be zero so nothing should be plotted
-            no_queen = no_queen_period(history['hatch_creation'], history['hatch_cutoff'], self.first_queen_time)
-            axes.broken_barh([(history['hatch_creation'], no_queen)], (5*hatch_index, 2), facecolors='tab:grey', alpha=0.75)
+        return {'injected': timeline.interval_masks(*intervals['injects'], hatcheries),
+                'missed': timeline.interval_masks(*intervals['missed'], hatcheries),
+                'no_queen': timeline.interval_masks(np.arange(hatcheries), intervals['hatch_creation'],
+                                                    intervals['hatch_creation'] + no_queen, hatcheries)}
 
-            missed = missed_injects(history['injects'], self.first_queen_time, history['hatch_creation'], history['hatch_cutoff'])
-            axes.broken_barh([(m[0], m[1] - m[0]) for m in missed], (5*hatch_index, 2), facecolors='tab:red', alpha=0.75)
 
-            proportion_injected.append(history['proportion_injected'])
+    def plot(self, axes, timeline, bands=None):
+        """ :param timeline: Timeline to plot on, until the cutoff (so that all plots are aligned)
+            :param bands: CorpusBands to compare the fraction of hatcheries injected with, if any
+        """
+        import matplotlib.patches as mpatches
+        from matplotlib.ticker import PercentFormatter
+        from ..plot_spans import add_bars
+
+        # the bars are drawn from the exact intervals, they need no grid
+        intervals = self.inject_intervals(timeline.end)
+        proportion_injected = intervals['proportion_injected']
+        # outside of injected intervals, we need to plot times when the hatchery existed but:
+        #  1. first queen wasn't born yet (when injects were not possible) - greyed out "no inject possible" period
+        #  2. queens (had) existed, but hatchery wasn't injected - red "missed inject" periods
+        # if hatch_creation is after the first queen, no_queen will be zero so nothing should be plotted
+        no_queen = no_queen_period(intervals['hatch_creation'], intervals['hatch_cutoff'], self.first_queen_time)
+
+        # plot hatcheries sorted by hatch_creation time, one collection per category for all of them
+        for (hatch, start, end), color, alpha in [(intervals['injects'], 'tab:green', 0.9),
+                                                  (intervals['missed'], 'tab:red', 0.75)]:
+            add_bars(axes, start, end, 5*hatch, 5*hatch + 2, facecolors=color, alpha=alpha)
+
+        # greyed-out time from hatch_creation until the first queen is born
+        hatch = np.arange(len(proportion_injected))
+        add_bars(axes, intervals['hatch_creation'], intervals['hatch_creation'] + no_queen, 5*hatch, 5*hatch + 2,
+                 facecolors='tab:grey', alpha=0.75)
 
         axes.set_yticks([5*i+1 for i in range(len(proportion_injected))])
         axes.set_yticklabels([f"{p*100:.0f}%" for p in proportion_injected])
@@ -196,4 +263,13 @@ class InjectTracker(object):
         injected_legend = mpatches.Patch(color='tab:green', label='injected', alpha=0.9)
         no_queen_legend = mpatches.Patch(color='tab:grey', label='no queen', alpha=0.9)
 
-        axes.legend(handles=[injected_legend, idle_legend, no_queen_legend], loc='upper left')
+        handles = [injected_legend, idle_legend, no_queen_legend]
+        if bands is not None:
+            twin = axes.twinx()
+            twin.set_ylim(0, 1)
+            twin.yaxis.set_major_formatter(PercentFormatter(1))
+            injected_plot = twin.stairs(injected_fraction(self.resample(timeline)), timeline.edges, baseline=None,
+                                        color='black', label='hatcheries injected')
+            handles += [injected_plot, bands.plot(twin, 'injected', timeline, 'black', 'corpus')]
+
+        axes.legend(handles=handles, loc='upper left')
@@ -1,17 +1,19 @@
-import matplotlib
-import matplotlib.patches as mpatches
 import numpy as np
 
-from matplotlib.ticker import FuncFormatter
-from ..replay_helpers import Entity, timestamp, real_seconds
+from ..replay_context import UnitType, unit_type_code
+from ..timeseries import TimeSeries
 from sc2reader.events import PlayerStatsEvent, UnitTypeChangeEvent, UnitBornEvent, UnitDiedEvent
 
 class LarvaeVsResourcesTracker(object):
     # larve and drones at the start of the game are 'born' just like any subsequent ones
+    EVENT_TYPES = (PlayerStatsEvent, UnitTypeChangeEvent, UnitBornEvent, UnitDiedEvent)
 
     def __init__(self, player_name):
         self.player_name = player_name
-        self.data = []
+        self.player_ids = None # set by resolve()
+        self.context = None
+        self.data = TimeSeries(supply_used=np.int32, supply_cap=np.int32, time=np.int32, minerals=np.int32,
+                               gas=np.int32, larvae=np.int32)
         self.larva_count = 0
         self.total_larvae = 0
         self.title = "Resources vs larvae"
@@ -20,21 +22,24 @@ class LarvaeVsResourcesTracker(object):
         self.minerals_used_current = 0 # "The total mineral cost of all current things" (army, economy, research)
         self.minerals_lost = 0 # The total mineral cost of all army units (buildings?) lost
 
+    def resolve(self, context):
+        # the dispatcher only passes on events of our player (and our player's units)
+        self.context = context
+        self.player_ids = context.player_ids(self.player_name)
+
     def consume_event(self, event):
-        if isinstance(event, PlayerStatsEvent) and event.player.name.startswith(self.player_name):
+        if isinstance(event, PlayerStatsEvent):
             # including our counts alongside game's periodic stats
-            self.data.append({
-                              'supply_used' : int(event.food_used + 0.5),
-                              'supply_cap' : int(event.food_made),
-                              'time' : event.second,
-                              'minerals' : event.minerals_current,
-                              'gas' : event.vespene_current,
-                              'larvae' : self.larva_count,
-                             })
+            self.data.append(supply_used=int(event.food_used + 0.5),
+                             supply_cap=int(event.food_made),
+                             time=event.second,
+                             minerals=event.minerals_current,
+                             gas=event.vespene_current,
+                             larvae=self.larva_count)
             self.minerals_lost = event.minerals_lost
             self.minerals_used_current = event.minerals_used_current
 
-        elif isinstance(event, UnitTypeChangeEvent) and event.unit.owner.name.startswith(self.player_name):
+        elif isinstance(event, UnitTypeChangeEvent):
             # event.unit_type_name is what the unit changed into; event.unit is the unit itself;
             # Notionally, the unit referenced by 'event.unit' doesn't change with these events, but in case of
             # larva it can be a bit confusing. The chain of events when making a unit is:
@@ -44,92 +49,94 @@ class LarvaeVsResourcesTracker(object):
             #
             # I don't know if it's possible for a PlayerStatsEvent to occur between steps 2 and 3 - if so, it would
             # overcount the larvae by 1.
-            if str(event.unit_type_name).startswith(Entity.LARVA):
-                unit_id = event.unit.id
-                assert event.unit.name == Entity.LARVA
+            new_type = unit_type_code(event.unit_type_name)
+            if new_type == UnitType.LARVA:
+                assert self.context.unit_code(event.unit) == UnitType.LARVA
                 # presumably, a unit just hatched - this larva should die immediately after this (so don't increment
                 # total_larvae, which is meant to count efficiency of larva production and injects - it would be great
                 # to just stop tracking UnitTypeChangeEvent entirely, but we do need to decrement larva_count when
                 # they turn into eggs)
                 self.larva_count += 1
             # sometimes eggs change into eggs, don't know what it means - ignoring those events
-            elif str(event.unit_type_name).startswith(Entity.EGG) and not event.unit.name.startswith(Entity.EGG):
+            elif new_type == UnitType.EGG and self.context.unit_code(event.unit) != UnitType.EGG:
                 # assuming only larva can change into egg
-                assert event.unit.name == Entity.LARVA
+                assert self.context.unit_code(event.unit) == UnitType.LARVA
+                self.larva_count -= 1
+
+        elif self.context.unit_code(event.unit) == UnitType.LARVA:
+            if isinstance(event, UnitBornEvent):
+                self.larva_count += 1
+                self.total_larvae += 1
+            else: # UnitDiedEvent
                 self.larva_count -= 1
-        elif (isinstance(event, UnitBornEvent)
-                and event.unit.owner is not None
-                and event.unit.owner.name.startswith(self.player_name)
-                and str(event.unit.name).startswith(Entity.LARVA)):
-            self.larva_count += 1
-            self.total_larvae += 1
-        elif (isinstance(event, UnitDiedEvent)
-                and event.unit.owner is not None
-                and event.unit.owner.name.startswith(self.player_name)
-                and str(event.unit.name).startswith(Entity.LARVA)):
-            self.larva_count -= 1
-
-    def plot(self, axes, cutoff_time):
-        """ cutoff_time - end time for the plot x-axis (so that all plots are aligned)
+
+    def resample(self, timeline):
+        """ Returns the samples step-held on the Timeline's grid (dict of arrays by column, see Timeline.step_hold()),
+            plus boolean arrays supply_blocked and supply_capped (less than 2 supply available, below and at 200 cap)
         """
-        def x_to_timestamp(x, pos):
-            if x >= 0 and x < len(self.data):
-                return timestamp(real_seconds(self.data[int(x)]['time']))
-
-        axes.xaxis.set_major_formatter(FuncFormatter(x_to_timestamp))
-        # the bar plot doesn't use time for x, but ordinals of PlayerStatEvents (otherwise bars come out very thin and
-        # far apart, i.e. one bar every 7 seconds, and nothing in between)
-        # in the effort for all plots to have their x-axis timestamps aligned, we scale the number of data points up
-        # fractionally, so that it corresponds to the same number of seconds as in the requested cutoff_time
-        # it's not pixel-perfect, not sure why
-        xmax = (cutoff_time / self.data[-1]['time']) * len(self.data)
-        axes.set_xlim(right=xmax, auto=True)
+        time_history = self.data['time']
+        resampled = {column: timeline.step_hold(time_history, self.data[column]) for column in self.data.columns if column != 'time'}
 
-        # we should not have consumed events past the requested cutoff_time point
-        assert(self.data[-1]['time'] <= cutoff_time)
-        x_axis = np.arange(len(self.data))
+        capped_cap = np.minimum(200, resampled['supply_cap'])
+        blocked = capped_cap - resampled['supply_used'] < 2
+        # nobody is blocked before the first sample
+        blocked &= timeline.times >= (time_history[0] if len(time_history) else timeline.end)
+        resampled['supply_blocked'] = blocked & (capped_cap < 200)
+        resampled['supply_capped'] = blocked & (capped_cap >= 200)
+        return resampled
 
-        mineral_history = [event['minerals'] for event in self.data]
-        avg_unspent_minerals = int(sum(mineral_history) / len(self.data))
 
-        # you start the game with 50 minerals, those are not mined
-        total_minerals_mined = self.minerals_lost + self.minerals_used_current + self.data[-1]['minerals'] - 50
+    def plot(self, axes, timeline, bands=None):
+        """ :param timeline: Timeline to plot on, until the cutoff (so that all plots are aligned)
+            :param bands: CorpusBands to compare banked larvae with, if any
+        """
+        import matplotlib.patches as mpatches
+        from ..plot_spans import runs, add_vspans
 
-        mineral_plot = axes.bar(x_axis, mineral_history, color='xkcd:sky blue', label=f'minerals (avg: {avg_unspent_minerals:d}, total: {total_minerals_mined})')
+        # we should not have consumed events past the requested cutoff_time point
+        assert(len(self.data) == 0 or self.data['time'][-1] <= timeline.end)
 
-        # this grossly undercounts gas mined, don't know where else to look (names matching those in sc2reader)
-        # total_gas_mined = self.vespene_lost + self.vespene_used_current + self.vespene_used_in_progress + self.data[-1]['gas'] + self.vespene_used_active_forces
+        # resources and larvae are only sampled every 10 (game) seconds, each sample holds until the next one
+        resampled = self.resample(timeline)
+        edges = timeline.edges
+
+        # averages are over the samples, like the trends (see plot_trends.LarvaSpendingTrend)
+        mineral_history = self.data['minerals']
+        avg_unspent_minerals = int(mineral_history.mean())
 
-        gas_history = [event['gas'] for event in self.data]
-        avg_unspent_gas = int(sum(gas_history) / len(self.data))
+        # you start the game with 50 minerals, those are not mined
+        total_minerals_mined = self.minerals_lost + self.minerals_used_current + int(mineral_history[-1]) - 50
+
+        minerals = resampled['minerals']
+        mineral_plot = axes.stairs(minerals, edges, fill=True, color='xkcd:sky blue', label=f'minerals (avg: {avg_unspent_minerals:d}, total: {total_minerals_mined})')
 
         # this grossly undercounts gas mined, don't know where else to look (names matching those in sc2reader)
         # total_gas_mined = self.vespene_lost + self.vespene_used_current + self.vespene_used_in_progress + self.data[-1]['gas'] + self.vespene_used_active_forces
 
-        gas_plot = axes.bar(x_axis, gas_history, bottom=mineral_history, color='xkcd:spring green', label=f'gas')
+        gas_plot = axes.stairs(minerals + resampled['gas'], edges, baseline=minerals, fill=True, color='xkcd:spring green', label=f'gas')
 
-        larvae_history = [event['larvae'] for event in self.data]
-        avg_unspent_larvae = sum(larvae_history) / len(self.data)
+        avg_unspent_larvae = self.data['larvae'].mean()
+        # all metrics are on the same grid, so e.g. larvae banked while supply blocked is just a mask away
+        blocked = resampled['supply_blocked'] | resampled['supply_capped']
+        blocked_larvae = f', {timeline.mean(resampled["larvae"], blocked):.2f} blocked' if blocked.any() else ''
 
         twin = axes.twinx()
         twin.set_ylim(top=20)
-        larvae_plot, = twin.plot(x_axis, larvae_history, color='tab:red', label='larvae (avg. {:.2f}, tot. {:d})'.format(avg_unspent_larvae, self.total_larvae))
+        larvae_plot = twin.stairs(resampled['larvae'], edges, baseline=None, color='tab:red',
+                              label=f'larvae (avg. {avg_unspent_larvae:.2f}{blocked_larvae}, tot. {self.total_larvae:d})')
+
+        handles = [mineral_plot, gas_plot, larvae_plot]
+        if bands is not None:
+            handles.append(bands.plot(twin, 'larvae', timeline, 'tab:red', 'larvae in corpus'))
 
         # shade the periods the player is supply blocked (has less than 2 supply available)
         # note that we're working with 10s granularity here (game-time), so the shaded regions are generally too wide
         # so we're not summing and printing them
-        for i, event in enumerate(self.data):
-            if i == 0:
-                continue
-
-            capped_cap = min(200, event['supply_cap'])
-            if capped_cap - event['supply_used'] < 2:
-                if capped_cap < 200:
-                    axes.axvspan(i-1, i, color='red', alpha=0.1, lw=0)
-                else:
-                    axes.axvspan(i-1, i, color='blue', alpha=0.1, lw=0)
+        for mask, color in [(resampled['supply_blocked'], 'red'), (resampled['supply_capped'], 'blue')]:
+            start, end = runs(mask)
+            add_vspans(axes, edges[start], edges[end], color=color, alpha=0.1, lw=0)
 
         supply_blocked_legend = mpatches.Patch(color='red', alpha=0.1, label='supply blocked')
         supply_capped_legend = mpatches.Patch(color='blue', alpha=0.1, label='supply capped')
 
-        axes.legend(handles=[mineral_plot, gas_plot, larvae_plot, supply_blocked_legend, supply_capped_legend], loc='upper left')
+        axes.legend(handles=handles + [supply_blocked_legend, supply_capped_legend], loc='upper left')
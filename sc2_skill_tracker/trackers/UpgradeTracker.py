@@ -1,8 +1,3 @@
-import numpy as np
-
-from matplotlib.ticker import FuncFormatter
-from ..replay_helpers import Entity, timestamp, real_seconds
-
 from sc2reader.events import UpgradeCompleteEvent
 from .DroneTracker import DroneTracker
 
@@ -24,24 +19,30 @@ UPGRADES_OF_INTEREST = {'ZergMissileWeaponsLevel1' : 'Ground Range 1',
                         'ZergFlyerArmorsLevel3'    : 'Air Carapace 3'}
 
 class UpgradeTracker(object):
+    EVENT_TYPES = (UpgradeCompleteEvent,)
+
     def __init__(self, player_name):
         self.player_name = player_name
+        self.player_ids = None # set by resolve()
         self.upgrades = []
 
 
+    def resolve(self, context):
+        # the dispatcher only passes on events of our player
+        self.player_ids = context.player_ids(self.player_name)
+
+
     def consume_event(self, event):
-        if (isinstance(event, UpgradeCompleteEvent)
-            and event.player.name.startswith(self.player_name)
-            and event.upgrade_type_name in UPGRADES_OF_INTEREST):
+        if event.upgrade_type_name in UPGRADES_OF_INTEREST:
             self.upgrades.append({'time' : event.second,
                                   'name' : event.upgrade_type_name})
 
 
-    def plot(self, axes, cutoff_time):
-        """ :param cutoff_time: end time for the plot x-axis (so that all plots are aligned)
+    def plot(self, axes, timeline):
+        """ :param timeline: Timeline to plot on, until the cutoff (so that all plots are aligned)
         """
         # we should not have consumed events past the requested cutoff_time point
-        assert(len(self.upgrades) == 0 or self.upgrades[-1]['time'] <= cutoff_time)
+        assert(len(self.upgrades) == 0 or self.upgrades[-1]['time'] <= timeline.end)
 
         for upgrade in self.upgrades:
             axes.axvline(x=upgrade['time'])
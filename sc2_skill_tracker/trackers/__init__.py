@@ -0,0 +1,35 @@
+"""
+Trackers consume replay events and plot what they measured. Each lives in a module of the same name - they import
+sc2reader (for the event types they declare) and are only imported once needed, see tracker_class().
+"""
+
+import importlib
+
+from collections.abc import Mapping
+
+
+def tracker_class(name):
+    """ Imports and returns the tracker class of the given name """
+    return getattr(importlib.import_module(f'.{name}', __name__), name)
+
+
+class LazyTrackers(Mapping):
+    """ Read-only {name: tracker class} dict whose names are known up front, but classes are only imported when
+        looked up - so that listing them (e.g. in --help) doesn't import sc2reader
+    """
+    def __init__(self, names):
+        self.names = list(names)
+
+
+    def __getitem__(self, name):
+        if name not in self.names:
+            raise KeyError(name)
+        return tracker_class(name)
+
+
+    def __iter__(self):
+        return iter(self.names)
+
+
+    def __len__(self):
+        return len(self.names)
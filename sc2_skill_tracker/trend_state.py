@@ -0,0 +1,173 @@
+"""
+Persistent state of a trend (see plot_trends): least squares line fits over its last data points, kept as running
+sums, and which replays (in chronological order) it has seen. Adding a replay's data point is O(1), so bringing the
+trend up to date after a game only needs that game's replay.
+
+Its size only depends on the fit windows, not on the number of replays seen - replays are remembered as a hash chain,
+not as a list.
+"""
+
+import hashlib
+import json
+
+from collections import deque
+
+from .file_helpers import atomic_write
+
+
+class LinearFit(object):
+    """ Least squares line through points that can be added and removed in O(1) """
+    def __init__(self, sums=(0, 0.0, 0.0, 0.0, 0.0)):
+        self.n, self.sx, self.sy, self.sxx, self.sxy = sums
+
+
+    def add(self, x, y, weight=1):
+        self.n += weight
+        self.sx += weight * x
+        self.sy += weight * y
+        self.sxx += weight * x * x
+        self.sxy += weight * x * y
+
+
+    def remove(self, x, y):
+        self.add(x, y, -1)
+
+
+    def line(self):
+        """ Returns (intercept, slope), or None with less than two distinct x """
+        denominator = self.n * self.sxx - self.sx * self.sx
+        if self.n < 2 or denominator == 0:
+            return None
+
+        slope = (self.n * self.sxy - self.sx * self.sy) / denominator
+        return (self.sy - slope * self.sx) / self.n, slope
+
+
+    @property
+    def sums(self):
+        return [self.n, self.sx, self.sy, self.sxx, self.sxy]
+
+
+class WindowedFit(object):
+    """ LinearFit of the last size points (of all points if size is None) """
+    def __init__(self, size=None):
+        self.size = size
+        self.points = deque()
+        self.fit = LinearFit()
+
+
+    def add(self, x, y):
+        self.points.append((x, y))
+        self.fit.add(x, y)
+        if self.size is not None and len(self.points) > self.size:
+            self.fit.remove(*self.points.popleft())
+
+
+    def line(self):
+        return self.fit.line()
+
+
+    def to_json(self):
+        return {'size': self.size, 'points': list(self.points), 'sums': self.fit.sums}
+
+
+    @staticmethod
+    def from_json(data):
+        window = WindowedFit(data['size'])
+        window.points = deque(tuple(point) for point in data['points'])
+        window.fit = LinearFit(data['sums'])
+        return window
+
+
+def chain_digest(replays, digest=''):
+    """ Hash of a sequence of replays, extended one replay at a time - equal for equal sequences (and prefixes) """
+    for replay in replays:
+        digest = hashlib.sha1(f'{digest}\n{replay}'.encode('utf-8')).hexdigest()
+    return digest
+
+
+class TrendState(object):
+    """ Fits over the data points of one trend (one metric of one player), which has seen some replays - skipping
+        ones whose data point was None. Usable data points are numbered from 0 (their x), the overall and recent fits
+        are over the last overall_size and recent_size of them.
+    """
+    # bump whenever the stored format changes
+    VERSION = 1
+
+    def __init__(self, overall_size=None, recent_size=None):
+        # the replays seen, in chronological order: the first, how many, and their chain_digest()
+        self.first_replay = None
+        self.length = 0
+        self.digest = ''
+        self.count = 0 # usable data points
+        self.overall = WindowedFit(overall_size)
+        self.recent = WindowedFit(recent_size)
+
+
+    def add(self, replay, value):
+        if self.length == 0:
+            self.first_replay = replay
+        self.length += 1
+        self.digest = chain_digest([replay], self.digest)
+
+        if value is not None:
+            self.overall.add(self.count, value)
+            self.recent.add(self.count, value)
+            self.count += 1
+
+
+    def seen(self):
+        """ Identifies the replays seen - states that saw the same replays have equal seen() """
+        return self.first_replay, self.length, self.digest
+
+
+    def pending(self, replays):
+        """ Returns replays that came after the ones in the state, or None if the state doesn't match replays (it's
+            empty, or replays were deleted or older ones added since) and has to be rebuilt
+            :param replays: chronological
+        """
+        if self.length == 0:
+            return None
+
+        try:
+            start = replays.index(self.first_replay)
+        except ValueError:
+            return None
+
+        end = start + self.length
+        if end > len(replays) or chain_digest(replays[start:end]) != self.digest:
+            return None
+
+        return replays[end:]
+
+
+    def save(self, path):
+        with atomic_write(path) as f:
+            json.dump({'version': TrendState.VERSION, 'first_replay': self.first_replay, 'length': self.length,
+                       'digest': self.digest, 'count': self.count, 'overall': self.overall.to_json(),
+                       'recent': self.recent.to_json()}, f)
+
+
+    @staticmethod
+    def load(path, overall_size=None, recent_size=None):
+        """ Returns the stored state, or an empty one if there's none or it was stored with different window sizes
+            (only the points in the windows are kept, so it can't be refitted - it's rebuilt from the result cache)
+        """
+        state = TrendState(overall_size, recent_size)
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return state
+
+        if data['version'] != TrendState.VERSION \
+           or data['overall']['size'] != overall_size or data['recent']['size'] != recent_size:
+            return state
+
+        state.first_replay = data['first_replay']
+        state.length = data['length']
+        state.digest = data['digest']
+        state.count = data['count']
+        state.overall = WindowedFit.from_json(data['overall'])
+        state.recent = WindowedFit.from_json(data['recent'])
+        return state
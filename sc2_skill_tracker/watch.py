@@ -0,0 +1,132 @@
+"""
+Watches the replays directory and processes new replays as soon as they're saved: renders their plots into the figure
+store (see plotter --stored), measures the trends into the result cache in the same pass over the replay and adds
+them to the trend states (see plot_trends), so that looking at the last game afterwards doesn't have to parse anything.
+
+The trend states are the ones plot_trends uses with the same player and a single cutoff, without --matchup and
+--min-duration.
+
+Uses inotify if inotify_simple is installed (pip install inotify_simple, Linux only), polls the directory otherwise.
+"""
+
+import argparse
+import os
+import time
+
+from .event_cache import EventCache
+from .figure_store import FigureStore
+from .plot_trends import TrendEngine, LarvaSpendingTrend, InjectTrend
+from .replay_helpers import replays_dir, cache_dir, file_hash, parse_timestamp
+from .replay_index import ReplayIndex
+from .result_cache import ResultCache
+from .trend_state import TrendState
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+
+def wait_for_changes(directory, poll_interval):
+    """ Yields whenever the directory might have changed """
+    if INotify is not None:
+        with INotify() as inotify:
+            # replays are complete once closed (or moved in)
+            inotify.add_watch(directory, flags.CLOSE_WRITE | flags.MOVED_TO)
+            while True:
+                inotify.read(read_delay=1000) # blocks until something happens, batching events for a second
+                yield
+    else:
+        while True:
+            time.sleep(poll_interval)
+            yield
+
+
+def process_replay(replay_file, index, store, engine, player):
+    # trends only make sense for games of the player
+    trends = engine.trends if any(name.startswith(player) for _, name, _, _ in index.players(replay_file)) else []
+
+    # the trends are measured in the same pass over the replay's events as the plots are rendered
+    trackers, cutoffs, checkpoint, measured = engine.riders(trends)
+    try:
+        paths = store.render(replay_file, file_hash(replay_file), event_cache=engine.event_cache,
+                             riders=(list(trackers.values()), cutoffs, checkpoint))
+        print(f"rendered {replay_file}: {', '.join(paths)}")
+    except Exception as e:
+        print(f"failed to render {replay_file}: {type(e).__name__}: {e}")
+
+    # rendering and measuring trends are independent - a replay whose plots fail (e.g. a game without Zerg players)
+    # still gets its trends measured (on their own, if rendering failed before they were), and the other way round
+    if trends:
+        try:
+            engine.lookup(replay_file, measured)
+        except Exception as e:
+            print(f"failed to measure trends of {replay_file}: {type(e).__name__}: {e}")
+
+
+def update_trends(index, engine, directory, player, cutoff, number_of_replays, recent_trend):
+    """ Adds replays the trend states haven't seen yet to them - normally just the ones processed since the last time,
+        which are looked up in the result cache
+    """
+    # as plot_trends -p player -c cutoff -n number_of_replays -r recent_trend stores them
+    replays = index.query(directory, player, None, cutoff)
+    state_paths = [trend.state_path(os.path.join(cache_dir, 'trends'), os.path.abspath(directory), None, cutoff)
+                   for trend in engine.trends]
+    states = [TrendState.load(path, number_of_replays, recent_trend) for path in state_paths]
+
+    added = engine.update(states, replays, number_of_replays)
+    for state, path in zip(states, state_paths):
+        state.save(path)
+    if added:
+        print(f"added {added} replays to the trends")
+
+
+def run(directory, player, cutoff, poll_interval, number_of_replays, recent_trend):
+    index = ReplayIndex()
+    store = FigureStore(os.path.join(cache_dir, 'figures'))
+    cache = ResultCache(os.path.join(cache_dir, 'results'))
+    event_cache = EventCache(os.path.join(cache_dir, 'events'))
+    engine = TrendEngine([LarvaSpendingTrend(cutoff, player), InjectTrend(cutoff, player)], cache, event_cache)
+
+    # catch up without rendering the whole history - just the latest replay, if it's not rendered yet
+    index.update(directory)
+    latest = index.recent(directory, 1)
+    if latest and store.get(file_hash(latest[0][0])) is None:
+        changed = [latest[0][0]]
+    else:
+        changed = []
+
+    changes = wait_for_changes(directory, poll_interval)
+    while True:
+        for replay_file in changed:
+            try:
+                process_replay(replay_file, index, store, engine, player)
+            except Exception as e:
+                # e.g. a replay that's still being written or one sc2reader can't read - keep watching, it'll be
+                # processed again if it changes
+                print(f"failed to process {replay_file}: {type(e).__name__}: {e}")
+        if changed:
+            try:
+                update_trends(index, engine, directory, player, cutoff, number_of_replays, recent_trend)
+            except Exception as e:
+                print(f"failed to update the trends: {type(e).__name__}: {e}")
+        cache.evict()
+        event_cache.evict()
+
+        next(changes)
+        changed = index.update(directory)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=f'Default replay search path: {replays_dir}')
+    parser.add_argument('-d', '--replays-dir', type=str, default=replays_dir, dest='replays_dir', action='store', help='replay search path')
+    parser.add_argument('-p', '--player', type=str, default='orastem', dest='player', action='store', help='player to measure trends for')
+    parser.add_argument('-c', '--cutoff-time', type=parse_timestamp, default='7:00', dest='cutoff', action='store', help='trend cutoff time in format mm:ss (should match plot_trends)')
+    parser.add_argument('-n', '--number-of-replays', type=int, default=50, dest='number_of_replays', action='store', help='number of replays the overall trend is fitted over (should match plot_trends)')
+    parser.add_argument('-r', '--recent-trend', type=int, default=15, dest='recent_trend', action='store', help='number of most recent replays the short term trend is fitted over (should match plot_trends)')
+    parser.add_argument('--poll-interval', type=float, default=5, dest='poll_interval', action='store', help='seconds between directory scans when inotify is not available')
+
+    args = parser.parse_args()
+
+    print(f"watching {args.replays_dir} ({'inotify' if INotify is not None else 'polling'})")
+    run(args.replays_dir, args.player, args.cutoff, args.poll_interval, args.number_of_replays, args.recent_trend)